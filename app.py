@@ -1,9 +1,26 @@
-from flask import Flask, request
-
-from dev_test import test_report_generation
-from email_module import gmail_send_message
-from form_response_module import parse_raw_response, retrieve_form_responses
-from report_module import clean_up_report, generate_report_markdown
+from flask import Flask, Response, request, send_file
+
+from artifact_cache_module import get_artifact_cache
+from backlog_module import get_backlog_run, start_backlog_run
+from church_module import generate_church_report, get_church_aggregates
+from form_response_module import (
+    WebhookEvents,
+    is_valid_webhook_payload,
+    iter_parsed_form_responses,
+    webhook_event,
+)
+from job_queue_module import get_job_queue
+from ledger_module import get_ledger
+from metrics_module import render_metrics
+from partial_response_module import get_partial_responses
+from render_pool_module import get_render_pool
+from send_scheduler_module import get_send_scheduler
+
+# Report rendering and Gmail are only imported where they are used (the job
+# queue and backlog workers, dev_test), so the server itself starts without
+# loading PyMuPDF, plotly or the Google API client. Reports, including
+# church reports, are rendered on the render processes
+# (render_pool_module), never in a request's thread.
 
 app = Flask(__name__)
 
@@ -19,38 +36,138 @@ def generate_backlog_reports():
     until = request.args.get("until")
     page_size = request.args.get("page_size", 1000, type=int)
 
-    responses = retrieve_form_responses(since=since, until=until, page_size=page_size)
-    print(f"Retrieved {len(responses.get('items', []))} responses")
-    for raw_response in responses.get("items", []):
-        form_response = parse_raw_response(raw_response)
-        report = generate_report_markdown(form_response)
-        gmail_send_message(form_response.answers.email, report)
-        clean_up_report(report)
-        print(f"Processed report for {form_response.answers.email}")
+    # Responses are fetched and parsed page by page as the background run
+    # consumes them
+    responses = iter_parsed_form_responses(
+        since=since, until=until, page_size=page_size, prefetch=True
+    )
+    run_id = start_backlog_run(responses)
+
+    return {"status": "accepted", "run_id": run_id}, 202
+
+
+@app.route("/backlog-reports/<run_id>", methods=["GET"])
+def backlog_report_progress(run_id):
+    run = get_backlog_run(run_id)
+    if run is None:
+        return {"status": "not found"}, 404
+    return run
+
+
+@app.route("/churches", methods=["GET"])
+def churches():
+    return {"churches": get_church_aggregates().list_churches()}
+
+
+@app.route("/churches/<church>/report", methods=["GET"])
+def church_report(church):
+    # Read from the running aggregates, so no responses are fetched again
+    summary = get_church_aggregates().summary(church)
+    if summary is None:
+        return {"status": "not found"}, 404
+
+    if request.args.get("format") == "pdf":
+        # Laid out on a render process, like every other report, rather than
+        # in this request's thread.
+        report = get_render_pool().submit(generate_church_report, summary).result()
+        return Response(report, mimetype="application/pdf")
+    return summary
+
+
+@app.route("/reports/<token>", methods=["GET"])
+def download_report(token):
+    cached = get_artifact_cache().find(token)
+    if cached is None:
+        return {"status": "not found"}, 404
+
+    # The content digest is the ETag, so If-None-Match gets a 304; the file
+    # itself is handed to the server's sendfile rather than read into memory.
+    path, digest = cached
+    return send_file(
+        path,
+        mimetype="application/pdf",
+        download_name="CMRA_Report.pdf",
+        etag=digest,
+        conditional=True,
+        max_age=0,
+    )
 
-    return {"responses": responses}
+
+@app.route("/reports/<token>/resend", methods=["POST"])
+def resend_report(token):
+    cached = get_artifact_cache().find(token)
+    if cached is None:
+        return {"status": "not found"}, 404
+
+    path, digest = cached
+    email = get_artifact_cache().metadata(token, digest).get("email")
+    if not email:
+        return {"status": "no email on record"}, 404
+
+    from email_module import gmail_send_message
+
+    with open(path, "rb") as report_file:
+        sent_message = gmail_send_message(email, report_file)
+    if sent_message is None:
+        return {"status": "failed to send"}, 502
+    return {"status": "sent", "message_id": sent_message["id"]}
 
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not is_valid_webhook_payload(data):
+        return {"status": "invalid payload"}, 400
+
+    event = webhook_event(data)
+    if event == WebhookEvents.form_response_partial:
+        # Only recorded; nothing is rendered until the response is submitted
+        get_partial_responses().record(data["event_id"], data["form_response"])
+        return {"status": "recorded"}, 200
+    if event != WebhookEvents.form_response:
+        return {"status": "ignored"}, 200
+
     print("Webhook received:", data["event_id"])
-    # Parse into domain object
-    form_response = parse_raw_response(data["form_response"])
+    token = data["form_response"].get("token")
+    if token and get_ledger().is_done(token):
+        # A redelivery of a response whose report has already been emailed
+        return {"status": "already processed"}, 200
+
+    # Persist the response and let the background workers render and email it
+    job_id = get_job_queue().enqueue(data["event_id"], data["form_response"])
+    if token:
+        get_partial_responses().submitted(token)
 
-    # Generate report for each response
-    report = generate_report_markdown(form_response)
+    return {"status": "accepted", "job_id": job_id}, 202
 
-    # Send email for each report
-    gmail_send_message(form_response.answers.email, report)
 
-    clean_up_report(report)
+@app.route("/jobs/dead-letters", methods=["GET"])
+def dead_letter_jobs():
+    return {"jobs": get_job_queue().list_dead_letters()}
 
-    # Process the webhook data as needed
-    return {"status": "success"}
+
+@app.route("/jobs/<int:job_id>/retry", methods=["POST"])
+def retry_dead_letter_job(job_id):
+    if not get_job_queue().retry_dead_letter(job_id):
+        return {"status": "not found"}, 404
+    return {"status": "requeued", "job_id": job_id}
+
+
+@app.route("/send-queue", methods=["GET"])
+def send_queue():
+    # This worker's queue; /metrics has the totals across workers
+    return get_send_scheduler().stats()
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 
 @app.route("/test-email", methods=["GET"])
 def test_email():
+    from dev_test import test_report_generation
+
     test_report_generation()
     return {"status": "email sent"}
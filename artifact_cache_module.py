@@ -0,0 +1,245 @@
+import json
+import os
+import re
+import threading
+import time
+
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "data/reports")
+# Least recently used reports are deleted once the cache grows past this.
+# 0 disables the cache.
+ARTIFACT_CACHE_MAX_MB = float(os.getenv("ARTIFACT_CACHE_MAX_MB", "1024"))
+
+# Typeform response tokens are alphanumeric; anything else never reaches the
+# filesystem.
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def report_metadata(form_response):
+    """
+    Returns:
+        dict: The details kept with a cached report, for resending it.
+    """
+    return {
+        "email": form_response.answers.email,
+        "church": form_response.answers.church,
+        "submitted_at": form_response.submitted_at,
+    }
+
+
+class ArtifactCache:
+    """
+    Rendered report PDFs kept on disk, so resends and downloads do not render
+    them again.
+
+    Each report is stored as "<token>/<digest>.pdf", where the digest covers
+    everything the report was rendered from (see `report_module.report_digest`),
+    next to a small JSON file with the respondent's details, so a token's
+    reports are found without listing every other token's. A file's
+    modification time records when it was last used, and the least recently
+    used reports are deleted once the cache is larger than `max_bytes`. Files
+    are shared by every worker and render process.
+
+    Each process keeps a running total of the cache's size from its last scan
+    plus what it has stored since, and only scans the whole cache to evict
+    once that total is over `max_bytes`. Other processes' reports are counted
+    at the next scan.
+    """
+
+    def __init__(
+        self, directory=ARTIFACT_CACHE_DIR, max_bytes=ARTIFACT_CACHE_MAX_MB * 2**20
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes in the cache as of the last scan, plus reports stored since.
+        self._size = None
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def _path(self, token, digest, extension="pdf"):
+        return os.path.join(self.directory, token, f"{digest}.{extension}")
+
+    def _reports(self, token):
+        # The token's cached reports, as (modification time, path, size).
+        reports = []
+        try:
+            entries = list(os.scandir(os.path.join(self.directory, token)))
+        except FileNotFoundError:
+            return reports
+        for entry in entries:
+            if entry.name.endswith(".pdf"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process while scanning.
+                    continue
+                reports.append((stat.st_mtime, entry.path, stat.st_size))
+        return reports
+
+    def find(self, token, digest=None):
+        """
+        Look up a cached report and mark it as recently used.
+
+        Args:
+            token (str): The response token.
+            digest (str, optional): The report's content digest. Without it,
+                the most recently stored report for the token is returned.
+
+        Returns:
+            tuple | None: The report's path and digest, or None on a miss.
+        """
+        if not self.enabled or not TOKEN_PATTERN.match(token or ""):
+            return None
+
+        if digest is None:
+            reports = self._reports(token)
+            if not reports:
+                return None
+            digest = os.path.basename(max(reports)[1])[: -len(".pdf")]
+
+        path = self._path(token, digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path, digest
+
+    def metadata(self, token, digest):
+        """
+        Returns:
+            dict: The details stored with a cached report, e.g. its email.
+        """
+        try:
+            with open(self._path(token, digest, "json")) as metadata_file:
+                return json.load(metadata_file)
+        except FileNotFoundError:
+            return {}
+
+    def store(self, token, digest, report, metadata=None):
+        """
+        Cache a rendered report, replacing any older report for the token.
+
+        Args:
+            token (str): The response token.
+            digest (str): The report's content digest.
+            report (bytes): The report's PDF bytes.
+            metadata (dict, optional): Details to keep with the report.
+        """
+        if not self.enabled or not TOKEN_PATTERN.match(token or ""):
+            return
+
+        # Write then rename so readers never see a partial file; the PDF is
+        # written last because its presence marks the entry as complete.
+        temp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.join(self.directory, token), exist_ok=True)
+        metadata_path = self._path(token, digest, "json")
+        with open(metadata_path + temp_suffix, "w") as metadata_file:
+            json.dump({**(metadata or {}), "created_at": time.time()}, metadata_file)
+        os.replace(metadata_path + temp_suffix, metadata_path)
+
+        path = self._path(token, digest)
+        with open(path + temp_suffix, "wb") as report_file:
+            report_file.write(report)
+        os.replace(path + temp_suffix, path)
+
+        added = len(report)
+        for _, stale_path, size in self._reports(token):
+            if stale_path != path:
+                self._remove(stale_path)
+                added -= size
+
+        with self._lock:
+            if self._size is not None:
+                self._size += added
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def get_or_render(self, token, digest, render, metadata=None):
+        """
+        Return a cached report, rendering and caching it on a miss.
+
+        Args:
+            render (callable): Renders the report's PDF bytes on a miss.
+
+        Returns:
+            bytes: The report's PDF bytes.
+        """
+        cached = self.find(token, digest)
+        if cached is not None:
+            try:
+                with open(cached[0], "rb") as report_file:
+                    return report_file.read()
+            except FileNotFoundError:
+                # Evicted by another process since it was found.
+                pass
+
+        report = render()
+        try:
+            self.store(token, digest, report, metadata)
+        except OSError as error:
+            # The report is still good; it just is not cached.
+            print(f"Failed to cache report {token}: {error!r}")
+        return report
+
+    def evict(self):
+        """
+        Delete least recently used reports until the cache fits `max_bytes`.
+        """
+        with self._lock:
+            reports = []
+            for entry in os.scandir(self.directory):
+                if entry.is_dir():
+                    reports += self._reports(entry.name)
+                elif entry.name.endswith(".pdf"):
+                    # Stored as "<token>.<digest>.pdf" by older versions; they
+                    # are evicted like the rest.
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    reports.append((stat.st_mtime, entry.path, stat.st_size))
+            total = sum(size for _, _, size in reports)
+
+            for _, path, size in sorted(reports):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+            self._size = total
+
+    def _remove(self, path):
+        for stale_path in (path, f"{os.path.splitext(path)[0]}.json"):
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+        directory = os.path.dirname(path)
+        if os.path.normpath(directory) == os.path.normpath(self.directory):
+            return
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # The token has another report, or one is being stored.
+            pass
+
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+
+def get_artifact_cache():
+    """
+    Returns:
+        ArtifactCache: This process's report artifact cache.
+    """
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache()
+        return _artifact_cache
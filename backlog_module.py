@@ -0,0 +1,297 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from church_module import get_church_aggregates
+from ledger_module import get_ledger
+from render_pool_module import new_render_pool, render_report
+from sqlite_module import sqlite_connection
+
+BACKLOG_DB_PATH = os.getenv("BACKLOG_DB_PATH", "data/backlog.sqlite3")
+BACKLOG_RENDER_PROCESSES = int(
+    os.getenv("BACKLOG_RENDER_PROCESSES", str(os.cpu_count() or 1))
+)
+BACKLOG_SEND_THREADS = int(os.getenv("BACKLOG_SEND_THREADS", "8"))
+# Rendered reports are emailed in Gmail batch requests of up to this many.
+BACKLOG_SEND_BATCH_SIZE = int(os.getenv("BACKLOG_SEND_BATCH_SIZE", "10"))
+
+STATUS_RUNNING = "running"
+STATUS_FINISHED = "finished"
+STATUS_FAILED = "failed"
+ITEM_SENT = "sent"
+ITEM_FAILED = "failed"
+ITEM_SKIPPED = "skipped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backlog_runs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted INTEGER NOT NULL DEFAULT 0,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS backlog_items (
+    run_id TEXT NOT NULL,
+    item_index INTEGER NOT NULL,
+    email TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    PRIMARY KEY (run_id, item_index)
+);
+"""
+
+
+class BacklogStore:
+    """
+    Progress of backlog runs, kept in SQLite so any gunicorn worker can
+    report on a run started by another.
+    """
+
+    def __init__(self, db_path=BACKLOG_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def create_run(self):
+        run_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO backlog_runs (id, status, created_at) VALUES (?, ?, ?)",
+            (run_id, STATUS_RUNNING, time.time()),
+        )
+        return run_id
+
+    def record_submitted(self, run_id):
+        self._connection().execute(
+            "UPDATE backlog_runs SET submitted = submitted + 1 WHERE id = ?",
+            (run_id,),
+        )
+
+    def record_item(self, run_id, item_index, email, error=None):
+        status = ITEM_FAILED if error else ITEM_SENT
+        counter = "failed" if error else "succeeded"
+        connection = self._connection()
+        connection.execute("BEGIN")
+        connection.execute(
+            "INSERT OR REPLACE INTO backlog_items"
+            " (run_id, item_index, email, status, error) VALUES (?, ?, ?, ?, ?)",
+            (run_id, item_index, email, status, error),
+        )
+        connection.execute(
+            f"UPDATE backlog_runs SET {counter} = {counter} + 1 WHERE id = ?",
+            (run_id,),
+        )
+        connection.execute("COMMIT")
+
+    def record_skipped(self, run_id, item_index, email=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO backlog_items"
+            " (run_id, item_index, email, status) VALUES (?, ?, ?, ?)",
+            (run_id, item_index, email, ITEM_SKIPPED),
+        )
+
+    def finish_run(self, run_id, error=None):
+        self._connection().execute(
+            "UPDATE backlog_runs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (STATUS_FAILED if error else STATUS_FINISHED, error, time.time(), run_id),
+        )
+
+    def get_run(self, run_id):
+        """
+        Returns:
+            dict | None: The run's progress and per-item results.
+        """
+        connection = self._connection()
+        run = connection.execute(
+            "SELECT * FROM backlog_runs WHERE id = ?", (run_id,)
+        ).fetchone()
+        if run is None:
+            return None
+
+        items = [
+            dict(item)
+            for item in connection.execute(
+                "SELECT item_index, email, status, error FROM backlog_items"
+                " WHERE run_id = ? ORDER BY item_index",
+                (run_id,),
+            )
+        ]
+        skipped = sum(item["status"] == ITEM_SKIPPED for item in items)
+        return {**dict(run), "skipped": skipped, "items": items}
+
+
+def send_backlog_reports(batch):
+    """
+    Email a batch of rendered reports in one Gmail batch request.
+
+    Args:
+        batch (list): (item_index, token, email, report) tuples.
+
+    Returns:
+        list: The sent message for each report, or None if it failed.
+    """
+    from email_module import gmail_send_messages
+
+    return gmail_send_messages([(email, report) for _, _, email, report in batch])
+
+
+def run_backlog(
+    raw_responses,
+    run_id=None,
+    store=None,
+    render_processes=BACKLOG_RENDER_PROCESSES,
+    send_threads=BACKLOG_SEND_THREADS,
+    send_batch_size=BACKLOG_SEND_BATCH_SIZE,
+):
+    """
+    Render and email a backlog of responses in parallel.
+
+    Reports are rendered on a process pool, one process per core, and sent
+    in Gmail batches from a separate thread pool so sending overlaps with
+    rendering. Only a bounded number of responses are in flight at once, so
+    `raw_responses` may be a lazy iterator over a backlog of any size.
+
+    Every response is added to its church's aggregates. Responses already
+    emailed, by an earlier run or the webhook, are then skipped before they
+    are rendered (see ledger_module).
+
+    Args:
+        raw_responses (iterable): The Typeform responses to process, parsed
+            (FormResponse) or raw.
+        run_id (str, optional): An existing run to record progress against.
+        store (BacklogStore, optional): Where progress is recorded.
+        render_processes (int): The number of render processes.
+        send_threads (int): The number of concurrent senders.
+        send_batch_size (int): The most reports to send in one batch request.
+
+    Returns:
+        str: The run id.
+    """
+    from form_response_module import parse_raw_response
+
+    store = store or BacklogStore()
+    run_id = run_id or store.create_run()
+    ledger = get_ledger()
+    church_aggregates = get_church_aggregates()
+    max_in_flight = render_processes * 2
+
+    with new_render_pool(render_processes) as render_pool, ThreadPoolExecutor(
+        max_workers=send_threads
+    ) as send_pool:
+        in_flight = {}
+        rendered = []
+
+        def on_sent(batch, future):
+            error = future.exception()
+            sent_messages = [None] * len(batch) if error else future.result()
+            for (item_index, token, email, _), sent_message in zip(
+                batch, sent_messages
+            ):
+                item_error = None
+                if sent_message is None:
+                    item_error = repr(error) if error else "Failed to email report"
+                store.record_item(run_id, item_index, email, item_error)
+                if token and item_error:
+                    ledger.fail(token, error or RuntimeError(item_error))
+                elif token:
+                    ledger.complete(token, sent_message.get("id"))
+                print(
+                    f"Backlog {run_id}: item {item_index} "
+                    f"{'failed' if item_error else 'sent'}"
+                )
+
+        def flush():
+            batch = rendered[:]
+            rendered.clear()
+            send_future = send_pool.submit(send_backlog_reports, batch)
+            send_future.add_done_callback(lambda future: on_sent(batch, future))
+
+        def collect(done):
+            for render_future in done:
+                item_index, token = in_flight.pop(render_future)
+                error = render_future.exception()
+                if error:
+                    store.record_item(run_id, item_index, None, repr(error))
+                    if token:
+                        ledger.fail(token, error)
+                    print(f"Backlog {run_id}: item {item_index} failed to render")
+                    continue
+
+                email, report = render_future.result()
+                rendered.append((item_index, token, email, report))
+                if len(rendered) >= send_batch_size:
+                    flush()
+
+        try:
+            for item_index, form_response in enumerate(raw_responses):
+                if isinstance(form_response, dict):
+                    form_response = parse_raw_response(form_response)
+                church_aggregates.add(form_response)
+
+                token, email = form_response.token, form_response.answers.email
+                if token and not ledger.claim(token):
+                    store.record_skipped(run_id, item_index, email)
+                    continue
+
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[render_pool.submit(render_report, form_response)] = (
+                    item_index,
+                    token,
+                )
+                store.record_submitted(run_id)
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            if rendered:
+                flush()
+        except Exception as error:
+            store.finish_run(run_id, repr(error))
+            raise
+
+    store.finish_run(run_id)
+    return run_id
+
+
+def start_backlog_run(raw_responses):
+    """
+    Start a backlog run in the background.
+
+    Args:
+        raw_responses (iterable): The raw Typeform responses to process.
+
+    Returns:
+        str: The run id, for polling with `get_backlog_run`.
+    """
+    store = BacklogStore()
+    run_id = store.create_run()
+
+    def run():
+        try:
+            run_backlog(raw_responses, run_id=run_id, store=store)
+        except Exception as error:
+            print(f"Backlog {run_id} failed: {error!r}")
+
+    threading.Thread(target=run, name=f"backlog-{run_id}", daemon=True).start()
+    return run_id
+
+
+def get_backlog_run(run_id):
+    """
+    Returns:
+        dict | None: The run's progress and per-item results.
+    """
+    return BacklogStore().get_run(run_id)
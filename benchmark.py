@@ -0,0 +1,281 @@
+"""
+Stage-level benchmarks for the report pipeline.
+
+Builds synthetic form responses with random scores from
+example-webhook-response.json and times each stage of turning one into an
+emailed report. Gmail is replaced by a stub, so nothing is sent.
+
+    python benchmark.py                     # compare against the baseline
+    python benchmark.py --update-baseline   # record a new baseline
+
+The run fails if any stage's median time regresses by more than the
+threshold against the baseline.
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from fitz import Archive
+
+import email_module
+import report_module
+from form_response_module import parse_raw_response
+from send_scheduler_module import SendScheduler
+
+EXAMPLE_RESPONSE_PATH = "example-webhook-response.json"
+BENCHMARK_BASELINE_PATH = os.getenv(
+    "BENCHMARK_BASELINE_PATH", "benchmark_baseline.json"
+)
+# A stage fails if its median is this fraction slower than the baseline's.
+BENCHMARK_REGRESSION_THRESHOLD = float(
+    os.getenv("BENCHMARK_REGRESSION_THRESHOLD", "0.2")
+)
+
+DOMAIN_SUBDOMAINS = {
+    "discipleship": ["education", "training"],
+    "sending": ["sending1", "membercare"],
+    "support": ["praying", "giving", "community"],
+    "structure": ["organisation", "policies", "partnerships"],
+}
+
+
+class StubGmailService:
+    """
+    Stands in for the Gmail API service: accepts messages without sending
+    them, so the benchmark measures building and encoding only.
+    """
+
+    def __init__(self):
+        self.sent = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body=None, media_body=None):
+        self.sent += 1
+        size = media_body.size() if media_body is not None else len(body["raw"])
+        self._response = {"id": f"benchmark-{self.sent}", "size": size}
+        return self
+
+    def execute(self):
+        return self._response
+
+
+def synthetic_raw_responses(count, seed=None):
+    """
+    Build raw Typeform responses with random sub-domain scores.
+
+    Domain scores (out of 25) and the final percentage are derived from the
+    sub-domain scores, so every response is internally consistent.
+
+    Args:
+        count (int): How many responses to build.
+        seed (int, optional): Seed for reproducible scores.
+
+    Returns:
+        list: The raw responses.
+    """
+    with open(EXAMPLE_RESPONSE_PATH, "r") as file:
+        example = json.load(file)["form_response"]
+
+    rng = random.Random(seed)
+    raw_responses = []
+    for index in range(count):
+        raw_response = copy.deepcopy(example)
+        raw_response["token"] = f"benchmark-{index}"
+
+        scores = {}
+        for domain, subdomains in DOMAIN_SUBDOMAINS.items():
+            for subdomain in subdomains:
+                scores[subdomain] = round(rng.uniform(0, 100), 2)
+            domain_percentage = statistics.mean(scores[s] for s in subdomains)
+            scores[domain] = round(domain_percentage / 4, 2)
+        scores["finalpercentage"] = round(
+            statistics.mean(scores[domain] * 4 for domain in DOMAIN_SUBDOMAINS)
+        )
+
+        for variable in raw_response["variables"]:
+            if variable["key"] in scores:
+                variable["number"] = scores[variable["key"]]
+        raw_responses.append(raw_response)
+    return raw_responses
+
+
+def run_pipeline(raw_response, timings, sizes=None):
+    """
+    Take one raw response through every stage, recording each stage's time
+    and the sizes of the report and of the message uploaded to Gmail.
+    """
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    data = timed("parse", parse_raw_response, raw_response)
+    # The chart stages fill the chart cache, so the layout stage below only
+    # measures markdown-to-PDF and not the charts again.
+    timed(
+        "radar_chart",
+        report_module.generate_executive_summary_radar_chart,
+        data,
+        Archive(),
+    )
+    timed("domain_table", report_module.generate_styled_table, data, Archive())
+    intermediate_report, breakdown_page_number = timed(
+        "markdown_to_pdf", report_module.lay_out_report, data
+    )
+    # Adds the static cover and end pages and, with precompiled fragments or
+    # vector charts enabled, also stamps in the breakdown pages and draws the
+    # charts.
+    report = timed(
+        "finish_report",
+        report_module.finish_report,
+        intermediate_report,
+        data,
+        breakdown_page_number,
+    )
+    message_file = timed(
+        "mime_encode", email_module.spool_report_message, data.answers.email, report
+    )
+    timed("gmail_send", email_module.gmail_send_message, data.answers.email, report)
+    timings.setdefault("total", []).append(time.perf_counter() - start)
+
+    if sizes is not None:
+        sizes.setdefault("report_kb", []).append(len(report) / 1024)
+        upload_size = message_file.seek(0, os.SEEK_END)
+        sizes.setdefault("upload_kb", []).append(upload_size / 1024)
+    message_file.close()
+
+
+def summarise(timings):
+    """
+    Returns:
+        dict: Median, 95th percentile and mean milliseconds for each stage.
+    """
+    summary = {}
+    for stage, samples in timings.items():
+        samples = sorted(samples)
+        summary[stage] = {
+            "median_ms": statistics.median(samples) * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "mean_ms": statistics.mean(samples) * 1000,
+        }
+    return summary
+
+
+def benchmark_config():
+    return {
+        "chart_backend": report_module.CHART_BACKEND.value,
+        "precompiled_fragments": report_module.PRECOMPILED_FRAGMENTS,
+        "image_dpi": report_module.REPORT_IMAGE_DPI,
+        "recompress": report_module.REPORT_RECOMPRESS,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Returns:
+        list: (stage, baseline median, current median) for each stage whose
+            median is more than `threshold` slower than the baseline's.
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        baseline_stats = baseline["stages"].get(stage)
+        if baseline_stats is None:
+            continue
+        if stats["median_ms"] > baseline_stats["median_ms"] * (1 + threshold):
+            regressions.append((stage, baseline_stats["median_ms"], stats["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BENCHMARK_BASELINE_PATH)
+    parser.add_argument(
+        "--threshold", type=float, default=BENCHMARK_REGRESSION_THRESHOLD
+    )
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    gmail_service = StubGmailService()
+    email_module.get_gmail_service = lambda: gmail_service
+    # The stub has no quota, so sends are not rate limited; otherwise the
+    # gmail_send stage would time waits for Gmail's rate rather than sends.
+    send_scheduler = SendScheduler(rate=1e9, burst=1e9)
+    email_module.get_send_scheduler = lambda: send_scheduler
+    report_module.preload_static_assets()
+    report_module.preload_report_fragments()
+
+    raw_responses = synthetic_raw_responses(args.warmup + args.iterations, args.seed)
+    # Warm-up runs start the chart renderer and other lazily created state.
+    for raw_response in raw_responses[: args.warmup]:
+        run_pipeline(raw_response, {})
+
+    timings = {}
+    sizes = {}
+    for raw_response in raw_responses[args.warmup :]:
+        run_pipeline(raw_response, timings, sizes)
+
+    results = {
+        "iterations": args.iterations,
+        "config": benchmark_config(),
+        "stages": summarise(timings),
+        "sizes": {name: statistics.median(values) for name, values in sizes.items()},
+    }
+
+    print(f"{'stage':<16}{'median ms':>12}{'p95 ms':>12}{'mean ms':>12}")
+    for stage, stats in results["stages"].items():
+        print(
+            f"{stage:<16}{stats['median_ms']:>12.2f}"
+            f"{stats['p95_ms']:>12.2f}{stats['mean_ms']:>12.2f}"
+        )
+    print(
+        f"Median report {results['sizes']['report_kb']:.1f} KB, "
+        f"uploaded to Gmail as {results['sizes']['upload_kb']:.1f} KB"
+    )
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("config") != results["config"]:
+        print(
+            f"Baseline was recorded with {baseline.get('config')}, not "
+            f"{results['config']}; re-run with --update-baseline to compare."
+        )
+        return 1
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for stage, baseline_ms, current_ms in regressions:
+        print(
+            f"Regression in {stage}: {baseline_ms:.2f} ms -> {current_ms:.2f} ms "
+            f"(threshold {args.threshold:.0%})"
+        )
+    if regressions:
+        return 1
+
+    print(f"No stage regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
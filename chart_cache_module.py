@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "512"))
+# Optional directory for a second, persistent cache tier shared by all workers.
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR")
+
+
+class ChartCache:
+    """
+    A bounded LRU cache of rendered chart images, addressed by a hash of
+    everything the image depends on.
+
+    Lookups check memory first, then the optional disk tier, and only render
+    on a miss in both.
+    """
+
+    def __init__(self, max_entries=CHART_CACHE_SIZE, directory=CHART_CACHE_DIR):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind, chart_inputs):
+        """
+        Returns:
+            str: The content address of a chart.
+        """
+        encoded = json.dumps([kind, chart_inputs], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get_or_render(self, kind, chart_inputs, render):
+        """
+        Return a cached chart image, rendering and caching it on a miss.
+
+        Args:
+            kind (str): The kind of chart, e.g. its image name.
+            chart_inputs (list): Everything the chart's image depends on.
+            render (callable): Renders the image bytes on a miss.
+
+        Returns:
+            bytes: The chart image.
+        """
+        key = self.key(kind, chart_inputs)
+
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+
+        image = self._read_disk(key)
+        if image is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._store(key, image)
+            return image
+
+        with self._lock:
+            self.misses += 1
+        image = render()
+        self._store(key, image)
+        self._write_disk(key, image)
+        return image
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit and miss counters and the number of cached images.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._images),
+            }
+
+    def _store(self, key, image):
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as image_file:
+                return image_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, image):
+        if not self.directory:
+            return
+        # Write then rename so other workers never read a partial image.
+        temp_path = f"{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, "wb") as image_file:
+            image_file.write(image)
+        os.replace(temp_path, self._disk_path(key))
+
+
+_chart_cache = None
+_chart_cache_lock = threading.Lock()
+
+
+def get_chart_cache():
+    """
+    Returns:
+        ChartCache: This process's chart cache.
+    """
+    global _chart_cache
+    with _chart_cache_lock:
+        if _chart_cache is None:
+            _chart_cache = ChartCache()
+        return _chart_cache
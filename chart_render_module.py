@@ -0,0 +1,251 @@
+import asyncio
+import os
+import threading
+
+import kaleido
+from plotly.io._defaults import defaults as plotly_image_defaults
+
+CHART_RENDER_POOL_SIZE = int(os.getenv("CHART_RENDER_POOL_SIZE", "1"))
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "90"))
+CHART_RENDER_HEALTH_CHECK_INTERVAL = float(
+    os.getenv("CHART_RENDER_HEALTH_CHECK_INTERVAL", "300")
+)
+
+# Smallest figure Kaleido will accept, used to probe that the browser still renders.
+HEALTH_CHECK_FIGURE = {"data": [], "layout": {"width": 10, "height": 10}}
+
+
+class ChartRenderPool:
+    """
+    A long-lived Kaleido browser with a fixed number of render tabs.
+
+    Kaleido normally launches and tears down a headless Chrome for every
+    `write_image` call. The pool keeps one browser open on a background event
+    loop so every chart in the worker reuses the same warm tabs.
+    """
+
+    def __init__(
+        self,
+        size=CHART_RENDER_POOL_SIZE,
+        timeout=CHART_RENDER_TIMEOUT,
+        health_check_interval=CHART_RENDER_HEALTH_CHECK_INTERVAL,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.restarts = 0
+
+        self._loop = None
+        self._loop_thread = None
+        self._kaleido = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._health_thread = None
+
+    def start(self):
+        """
+        Start the event loop thread, open the browser and begin health checks.
+        """
+        with self._lock:
+            if self._loop is not None:
+                return
+
+            self._stopped.clear()
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever, name="chart-render-loop", daemon=True
+            )
+            self._loop_thread.start()
+            self._open_browser()
+
+        if self.health_check_interval > 0:
+            self._health_thread = threading.Thread(
+                target=self._run_health_checks, name="chart-render-health", daemon=True
+            )
+            self._health_thread.start()
+
+        print(f"Chart render pool started with {self.size} tab(s)")
+
+    def stop(self):
+        """
+        Close the browser and stop the event loop thread.
+        """
+        self._stopped.set()
+        with self._lock:
+            if self._loop is None:
+                return
+            self._close_browser()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join(timeout=self.timeout)
+            self._loop.close()
+            self._loop = None
+            self._loop_thread = None
+
+    def render(self, fig, path=None):
+        """
+        Render a plotly figure to PNG using the warm browser.
+
+        A failed render is treated as a crashed renderer: the browser is
+        replaced and the render is retried once before the error is raised.
+
+        Args:
+            fig (plotly.graph_objects.Figure | dict): The figure to render.
+            path (str, optional): Where to write the PNG. If omitted, only the
+                bytes are returned.
+
+        Returns:
+            bytes: The rendered PNG.
+        """
+        fig_dict = fig if isinstance(fig, dict) else fig.to_dict()
+        generation = self._generation
+
+        try:
+            image_bytes = self._calc_fig(fig_dict)
+        except Exception as error:
+            print(f"Chart renderer failed ({error!r}), replacing it and retrying...")
+            self.restart(generation)
+            image_bytes = self._calc_fig(fig_dict)
+
+        if path:
+            with open(path, "wb") as image_file:
+                image_file.write(image_bytes)
+        return image_bytes
+
+    def check_health(self):
+        """
+        Render a tiny probe figure.
+
+        Returns:
+            bool: True if the browser rendered the probe within the timeout.
+        """
+        try:
+            self._calc_fig(HEALTH_CHECK_FIGURE)
+            return True
+        except Exception as error:
+            print(f"Chart render pool health check failed: {error!r}")
+            return False
+
+    def restart(self, generation=None):
+        """
+        Replace the browser with a fresh one.
+
+        Args:
+            generation (int, optional): The browser generation the caller saw
+                fail. If another thread has already replaced that browser, the
+                restart is skipped.
+        """
+        with self._lock:
+            if self._loop is None:
+                raise RuntimeError("Chart render pool is not running")
+            if generation is not None and generation != self._generation:
+                return
+            self._close_browser()
+            self._open_browser()
+            self.restarts += 1
+
+    def _calc_fig(self, fig_dict):
+        kaleido_instance = self._kaleido
+        if kaleido_instance is None:
+            raise RuntimeError("Chart render pool is not running")
+
+        # Same options plotly's own `write_image` passes to Kaleido.
+        opts = dict(
+            format=plotly_image_defaults.default_format,
+            width=plotly_image_defaults.default_width,
+            height=plotly_image_defaults.default_height,
+            scale=plotly_image_defaults.default_scale,
+        )
+        future = asyncio.run_coroutine_threadsafe(
+            kaleido_instance.calc_fig(
+                fig_dict, opts=opts, topojson=plotly_image_defaults.topojson
+            ),
+            self._loop,
+        )
+        return future.result(timeout=self.timeout)
+
+    def _open_browser(self):
+        kopts = {"n": self.size, "timeout": self.timeout}
+        if plotly_image_defaults.plotlyjs:
+            kopts["plotlyjs"] = plotly_image_defaults.plotlyjs
+        if plotly_image_defaults.mathjax:
+            kopts["mathjax"] = plotly_image_defaults.mathjax
+
+        async def open_browser():
+            browser = kaleido.Kaleido(**kopts)
+            await browser.open()
+            return browser
+
+        self._kaleido = asyncio.run_coroutine_threadsafe(
+            open_browser(), self._loop
+        ).result(timeout=self.timeout)
+        self._generation += 1
+
+    def _close_browser(self):
+        browser, self._kaleido = self._kaleido, None
+        if browser is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(browser.close(), self._loop).result(
+                timeout=self.timeout
+            )
+        except Exception as error:
+            print(f"Failed to close chart renderer cleanly: {error!r}")
+
+    def _run_health_checks(self):
+        while not self._stopped.wait(self.health_check_interval):
+            generation = self._generation
+            if not self.check_health():
+                try:
+                    self.restart(generation)
+                except Exception as error:
+                    print(f"Failed to restart chart render pool: {error!r}")
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def start_render_pool(size=CHART_RENDER_POOL_SIZE):
+    """
+    Start this process's chart render pool. Call once per worker after fork.
+
+    Args:
+        size (int): The number of Kaleido tabs to keep warm.
+
+    Returns:
+        ChartRenderPool: The running pool.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ChartRenderPool(size=size)
+            _render_pool.start()
+        return _render_pool
+
+
+def stop_render_pool():
+    """
+    Stop this process's chart render pool, if it was started.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.stop()
+            _render_pool = None
+
+
+def render_figure(fig, path=None):
+    """
+    Render a plotly figure to PNG through the process-wide render pool.
+
+    The pool is started on first use if the server did not start it at boot.
+
+    Args:
+        fig (plotly.graph_objects.Figure): The figure to render.
+        path (str, optional): Where to write the PNG.
+
+    Returns:
+        bytes: The rendered PNG.
+    """
+    return start_render_pool().render(fig, path)
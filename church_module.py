@@ -0,0 +1,336 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from interfaces.form_response import (
+    DOMAIN_MAX_SCORE,
+    DOMAINS,
+    SCORE_FIELDS,
+    SUBDOMAINS,
+    calculate_stages,
+)
+from sqlite_module import sqlite_connection
+
+CHURCH_DB_PATH = os.getenv("CHURCH_DB_PATH", "data/churches.sqlite3")
+# A sub-domain is a consensus strength (or growth area) when at least this
+# share of a church's respondents have it in their own top (or bottom) 3.
+CHURCH_CONSENSUS_SHARE = float(os.getenv("CHURCH_CONSENSUS_SHARE", "0.5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS churches (
+    church_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    respondents INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS church_respondents (
+    token TEXT PRIMARY KEY,
+    church_key TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS church_scores (
+    church_key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    minimum REAL NOT NULL,
+    maximum REAL NOT NULL,
+    strongest INTEGER NOT NULL DEFAULT 0,
+    weakest INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (church_key, field)
+);
+"""
+
+
+def church_key(name):
+    """
+    Returns:
+        str: The church name with case and spacing normalised, so respondents
+            who type it slightly differently are grouped together.
+    """
+    return " ".join(name.split()).casefold()
+
+
+class ChurchAggregates:
+    """
+    Running per-church statistics of every score, kept in SQLite.
+
+    Each response updates its church's count, mean and sum of squared
+    differences (Welford's method) per score, plus how often each sub-domain
+    is among the respondent's 3 strongest or weakest. A church's report is
+    read straight from these, without fetching its responses again.
+    """
+
+    def __init__(self, db_path=CHURCH_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def add(self, form_response):
+        """
+        Add a response to its church's aggregates. Each response token is
+        only counted once, so redeliveries and backlog re-runs are harmless.
+
+        Args:
+            form_response (FormResponse): The parsed response.
+
+        Returns:
+            bool: True if the response was added.
+        """
+        church = form_response.answers.church
+        if not church or not church.strip() or not form_response.token:
+            return False
+
+        key = church_key(church)
+        scores = form_response.scores
+        strongest = {name for name, _ in scores.strongest_subdomains(3)}
+        weakest = {name for name, _ in scores.weakest_subdomains(3)}
+        now = time.time()
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO church_respondents (token, church_key, added_at)"
+                " VALUES (?, ?, ?)",
+                (form_response.token, key, now),
+            )
+            if cursor.rowcount == 0:
+                connection.execute("COMMIT")
+                return False
+
+            connection.execute(
+                "INSERT INTO churches (church_key, name, respondents, updated_at)"
+                " VALUES (?, ?, 1, ?) ON CONFLICT (church_key) DO UPDATE SET"
+                " name = excluded.name, respondents = respondents + 1,"
+                " updated_at = excluded.updated_at",
+                (key, " ".join(church.split()), now),
+            )
+            existing = {
+                row["field"]: row
+                for row in connection.execute(
+                    "SELECT * FROM church_scores WHERE church_key = ?", (key,)
+                )
+            }
+
+            rows = []
+            for field, value in zip(SCORE_FIELDS, scores.values.tolist()):
+                if math.isnan(value):
+                    continue
+                row = existing.get(field)
+                if row is None:
+                    count, mean, m2 = 1, value, 0.0
+                    minimum = maximum = value
+                    strongest_count = weakest_count = 0
+                else:
+                    count = row["count"] + 1
+                    delta = value - row["mean"]
+                    mean = row["mean"] + delta / count
+                    m2 = row["m2"] + delta * (value - mean)
+                    minimum = min(row["minimum"], value)
+                    maximum = max(row["maximum"], value)
+                    strongest_count, weakest_count = row["strongest"], row["weakest"]
+                rows.append(
+                    (
+                        key,
+                        field,
+                        count,
+                        mean,
+                        m2,
+                        minimum,
+                        maximum,
+                        strongest_count + (field in strongest),
+                        weakest_count + (field in weakest),
+                    )
+                )
+            connection.executemany(
+                "INSERT OR REPLACE INTO church_scores (church_key, field, count,"
+                " mean, m2, minimum, maximum, strongest, weakest)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return True
+
+    def list_churches(self):
+        """
+        Returns:
+            list: Each church's name and number of respondents.
+        """
+        rows = self._connection().execute(
+            "SELECT name, respondents, updated_at FROM churches ORDER BY name"
+        )
+        return [dict(row) for row in rows]
+
+    def summary(self, church, consensus_share=CHURCH_CONSENSUS_SHARE):
+        """
+        Summarise a church's respondents from its running aggregates.
+
+        Domain statistics are given as percentages, like sub-domain scores.
+
+        Args:
+            church (str): The church's name.
+            consensus_share (float): The share of respondents that must rank
+                a sub-domain among their 3 strongest (or weakest) for it to be
+                a consensus strength (or growth area).
+
+        Returns:
+            dict | None: The church's summary, or None if it has no
+                respondents.
+        """
+        key = church_key(church)
+        connection = self._connection()
+        church_row = connection.execute(
+            "SELECT * FROM churches WHERE church_key = ?", (key,)
+        ).fetchone()
+        if church_row is None:
+            return None
+
+        rows = {
+            row["field"]: row
+            for row in connection.execute(
+                "SELECT * FROM church_scores WHERE church_key = ?", (key,)
+            )
+        }
+        respondents = church_row["respondents"]
+
+        def statistics(field, scale=1):
+            row = rows.get(field)
+            if row is None:
+                return None
+            std = math.sqrt(row["m2"] / (row["count"] - 1)) if row["count"] > 1 else 0
+            return {
+                "respondents": row["count"],
+                "mean": row["mean"] * scale,
+                "std": std * scale,
+                "min": row["minimum"] * scale,
+                "max": row["maximum"] * scale,
+            }
+
+        def with_stage(stats):
+            if stats is not None:
+                stats["stage"] = int(calculate_stages(np.array(stats["mean"])))
+            return stats
+
+        domains = {
+            domain: with_stage(statistics(domain, 100 / DOMAIN_MAX_SCORE))
+            for domain in DOMAINS
+        }
+        subdomains = {
+            subdomain: with_stage(statistics(subdomain)) for subdomain in SUBDOMAINS
+        }
+        for subdomain, stats in subdomains.items():
+            if stats is not None:
+                stats["strongest_share"] = rows[subdomain]["strongest"] / respondents
+                stats["weakest_share"] = rows[subdomain]["weakest"] / respondents
+
+        def consensus(share):
+            names = [
+                subdomain
+                for subdomain, stats in subdomains.items()
+                if stats is not None and stats[share] >= consensus_share
+            ]
+            return sorted(
+                names,
+                key=lambda name: subdomains[name]["mean"],
+                reverse=share == "strongest_share",
+            )
+
+        return {
+            "church": church_row["name"],
+            "respondents": respondents,
+            "updated_at": church_row["updated_at"],
+            "finalpercentage": statistics("finalpercentage"),
+            "domains": domains,
+            "subdomains": subdomains,
+            "consensus_strengths": consensus("strongest_share"),
+            "growth_areas": consensus("weakest_share"),
+        }
+
+
+def generate_church_report(summary):
+    """
+    Lay out a church's summary (see `ChurchAggregates.summary`) as a PDF.
+
+    Returns:
+        bytes: The report's PDF bytes.
+    """
+    import io
+
+    from markdown_pdf import MarkdownPdf, Section
+
+    from report_module import LOGO_IMAGE_PATH, Domains, Subdomains
+
+    def spread(stats):
+        if stats is None:
+            return "| – | – | – | – |"
+        return (
+            f"| {stats['mean']:.1f}% | {stats['std']:.1f} "
+            f"| {stats['min']:.0f}–{stats['max']:.0f}% | Stage {stats['stage']} |"
+        )
+
+    def names(subdomains):
+        if not subdomains:
+            return "No clear consensus among respondents.\n\n"
+        return "".join(f"- {Subdomains[name].value}\n" for name in subdomains) + "\n"
+
+    overall = summary["finalpercentage"]
+    cover = f"![Logo image]({LOGO_IMAGE_PATH})\n\n"
+    cover += f"# Church Missions Readiness Summary\n\n<br><br>Prepared for: {summary['church']}\n\n"
+    cover += f"Respondents: {summary['respondents']}\n\n"
+    if overall is not None:
+        cover += f"Average readiness score: {overall['mean']:.0f}%\n\n"
+    cover += "Based on the Antioch21 Church Missions Readiness Assessment (CMRA)\n\n"
+
+    body = "# Consensus Strengths\n\n" + names(summary["consensus_strengths"])
+    body += "# Shared Areas for Growth\n\n" + names(summary["growth_areas"])
+    body += "# Domains\n\n| Domain | Mean | Std. dev. | Range | Stage (Avg) |\n"
+    body += "| --- | :---: | :---: | :---: | :---: |\n"
+    for domain, stats in summary["domains"].items():
+        body += f"| {Domains[domain].value} {spread(stats)}\n"
+    body += (
+        "\n# Sub-domains\n\n| Sub-domain | Mean | Std. dev. | Range | Stage (Avg) |\n"
+    )
+    body += "| --- | :---: | :---: | :---: | :---: |\n"
+    for subdomain, stats in summary["subdomains"].items():
+        body += f"| {Subdomains[subdomain].value} {spread(stats)}\n"
+
+    cover_css = "h1 { font-family: Arial, sans-serif; text-align: center; margin-top: 50px; } p { font-family: Arial, sans-serif; text-align: center; }"
+    css = "h1 { font-family: Arial, sans-serif; color: #AD0B0B; } table, th, td { border: 1px solid black; font-family: Arial, sans-serif; } p, li { font-family: Arial, sans-serif; }"
+
+    pdf = MarkdownPdf(toc_level=0)
+    pdf.add_section(Section(cover, toc=False), user_css=cover_css)
+    pdf.add_section(Section(body, toc=False), user_css=css)
+    report = io.BytesIO()
+    pdf.save(report)
+    return report.getvalue()
+
+
+_church_aggregates = None
+_church_aggregates_lock = threading.Lock()
+
+
+def get_church_aggregates():
+    """
+    Returns:
+        ChurchAggregates: This process's church aggregates.
+    """
+    global _church_aggregates
+    with _church_aggregates_lock:
+        if _church_aggregates is None:
+            _church_aggregates = ChurchAggregates()
+        return _church_aggregates
@@ -7,11 +7,9 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from backlog_module import get_backlog_run, run_backlog
 from email_module import gmail_send_message
-from form_response_module import parse_raw_response
-from report_module import (
-    generate_report_markdown,
-)
+from render_pool_module import get_render_pool, render_report
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
@@ -59,19 +57,17 @@ def main():
 def test_report_generation():
     with open("example-webhook-response.json", "r") as file:
         data = json.load(file)
-        form_response = parse_raw_response(data["form_response"])
-        report_path = generate_report_markdown(form_response)
-        gmail_send_message("pang.triston@gmail.com", report_path)
+    # Rendered on a render process, as the job queue renders reports.
+    _, report = get_render_pool().submit(render_report, data["form_response"]).result()
+    gmail_send_message("pang.triston@gmail.com", report)
 
 
 def generate_backlogged_reports():
     with open("input-responses.json", "r") as file:
         data = json.load(file)
-        for raw_response in data["items"]:
-            form_response = parse_raw_response(raw_response)
-            report_path = generate_report_markdown(form_response)
-            gmail_send_message(form_response.answers.email, report_path)
-            print(f"Processed report for {form_response.answers.email}")
+    run_id = run_backlog(data["items"])
+    run = get_backlog_run(run_id)
+    print(f"Backlog {run_id}: {run['succeeded']} sent, {run['failed']} failed")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,29 @@
+import asyncio
 import base64
-import mimetypes
+import io
+import json
 import os.path
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from datetime import datetime, timedelta, timezone
 from email import policy
 from email.message import EmailMessage
 
+import aiohttp
+import httplib2
+from google.auth.credentials import AnonymousCredentials
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, MediaIoBaseUpload
+
+from event_loop_module import get_http_session
+from metrics_module import EMAIL_FAILURES, EMAILS_SENT, timed_stage
+from send_scheduler_module import get_send_scheduler, is_retryable
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -16,6 +31,26 @@ SCOPES = [
     "https://www.googleapis.com/auth/gmail.addons.current.action.compose",
     "https://www.googleapis.com/auth/gmail.send",
 ]
+# Gmail recommends batches of no more than 50 requests.
+GMAIL_BATCH_SIZE = 50
+# Points the Gmail client at another server, e.g. the local stand-in in
+# stand_in_services.py for load testing. No credentials are sent to it.
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT")
+GMAIL_API_BASE_URL = (GMAIL_API_ENDPOINT or "https://gmail.googleapis.com").rstrip("/")
+GMAIL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=120)
+# Messages up to this size are uploaded in one request; larger ones are
+# uploaded in chunks of this size. Gmail takes chunks in multiples of 256 KB.
+GMAIL_UPLOAD_CHUNK_SIZE = max(
+    1, round(float(os.getenv("GMAIL_UPLOAD_CHUNK_MB", "1")) * 4)
+) * (256 * 1024)
+
+_creds = None
+_creds_lock = threading.Lock()
+# Created on the event loop, the first time credentials are refreshed there.
+_async_refresh_lock = None
+# googleapiclient services share an httplib2 connection, which is not
+# thread-safe, so each thread builds its own and then keeps reusing it.
+_thread_local = threading.local()
 
 
 def headless_auth(flow):
@@ -59,74 +94,506 @@ def set_creds():
     return creds
 
 
-def gmail_send_message(recipient_email, report_path):
-    """Create and send an email message
-    Print the returned  message id
-    Returns: Message object, including message id
+def get_credentials():
+    """
+    Returns the process-wide Gmail credentials, refreshing them if expired.
 
-    Load pre-authorized user credentials from the environment.
-    TODO(developer) - See https://developers.google.com/identity
-    for guides on implementing OAuth2 for the application.
+    token.json is only read on first use and only rewritten after a refresh.
+    A single lock makes sure concurrent senders refresh at most once.
     """
-    creds = set_creds()
+    global _creds
+    with _creds_lock:
+        if GMAIL_API_ENDPOINT:
+            _creds = _creds or AnonymousCredentials()
+        elif _creds is None:
+            _creds = set_creds()
+        elif not _creds.valid:
+            if _creds.refresh_token:
+                _creds.refresh(Request())
+                with open("token.json", "w") as token:
+                    token.write(_creds.to_json())
+            else:
+                _creds = set_creds()
+        return _creds
 
-    try:
-        service = build("gmail", "v1", credentials=creds)
-        message = EmailMessage(policy=policy.SMTP.clone(max_line_length=1000))
 
-        message.set_content(
-            "Greetings from Antioch21! If you are seeing this, the email's full message failed to load. Please refer to further details in your CMRA Report attached.",
-        )
+async def get_credentials_async():
+    """
+    Like `get_credentials`, but refreshes expired credentials on the event
+    loop. Loading them the first time (or logging in again) still reads
+    token.json and may prompt, so that runs in a thread.
+    """
+    global _async_refresh_lock
+    creds = _creds
+    if creds is None or GMAIL_API_ENDPOINT:
+        return await asyncio.to_thread(get_credentials)
+    if creds.valid:
+        return creds
+    if not creds.refresh_token:
+        return await asyncio.to_thread(get_credentials)
 
-        message.add_alternative(
-            """\
-        <html>
-        <body>
-            <p>Greetings from Antioch21!<br><br>
-            Thank you for completing the Church Missions Readiness Assessment (CMRA). Attached is your individualized report with your overall readiness score and detailed insights for each domain.<br><br>
-            Inside, you’ll find suggested next steps, space for reflection, and prompts to guide discussion with your church leadership or fellow participants. We encourage you to share and compare your reports if others in your church also completed the CMRA.<br><br>
-            If you’d like to process your results or explore ways to grow in missions readiness, we’d be glad to connect - just reach out at <a href="mailto:admin@antioch21.sg">admin@antioch21.sg</a>.<br><br>
-            Warm regards,<br>
-            Darrell Ong<br>
-            Director Of Partnerships<br>
-            Antioch21
-            </p>
-        </body>
-        </html>
-        """,
-            subtype="html",
+    if _async_refresh_lock is None:
+        _async_refresh_lock = asyncio.Lock()
+    async with _async_refresh_lock:
+        if not creds.valid:
+            await refresh_credentials_async(creds)
+    return creds
+
+
+async def refresh_credentials_async(creds):
+    """
+    Refresh OAuth credentials with their refresh token and save them to
+    token.json, as `google.oauth2.credentials.Credentials.refresh` does.
+    """
+    async with get_http_session().post(
+        creds.token_uri,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": creds.refresh_token,
+            "client_id": creds.client_id,
+            "client_secret": creds.client_secret,
+        },
+        timeout=GMAIL_REQUEST_TIMEOUT,
+    ) as response:
+        token = await gmail_response_json(response)
+
+    # google-auth keeps expiry as a naive UTC datetime.
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with _creds_lock:
+        creds.token = token["access_token"]
+        creds.expiry = now + timedelta(seconds=token.get("expires_in", 3600))
+        creds_json = creds.to_json()
+    await asyncio.to_thread(write_token_file, creds_json)
+
+
+def write_token_file(creds_json):
+    with _creds_lock:
+        with open("token.json", "w") as token:
+            token.write(creds_json)
+
+
+def get_gmail_service():
+    """
+    Returns this thread's Gmail service, building it only once per thread
+    (or again if the credentials were replaced).
+    """
+    creds = get_credentials()
+    service = getattr(_thread_local, "service", None)
+    if service is None or _thread_local.creds is not creds:
+        client_options = (
+            {"api_endpoint": GMAIL_API_ENDPOINT} if GMAIL_API_ENDPOINT else None
+        )
+        service = build(
+            "gmail",
+            "v1",
+            credentials=creds,
+            cache_discovery=False,
+            client_options=client_options,
         )
+        _thread_local.service = service
+        _thread_local.creds = creds
+    return service
+
 
-        message["To"] = recipient_email
-        message["From"] = "admin@antioch21.sg"
-        message["Subject"] = (
-            "Your CMRA Report - A Snapshot of Your Church’s Missions Readiness"
+def new_batch_request(service, callback):
+    # The batch URL comes from the discovery document, so it ignores
+    # GMAIL_API_ENDPOINT unless it is set here.
+    if GMAIL_API_ENDPOINT:
+        batch_uri = f"{GMAIL_API_ENDPOINT.rstrip('/')}/batch"
+        return BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+    return service.new_batch_http_request(callback=callback)
+
+
+MESSAGE_POLICY = policy.SMTP.clone(max_line_length=1000)
+MESSAGE_FROM = "admin@antioch21.sg"
+MESSAGE_SUBJECT = "Your CMRA Report - A Snapshot of Your Church’s Missions Readiness"
+MESSAGE_TEXT = "Greetings from Antioch21! If you are seeing this, the email's full message failed to load. Please refer to further details in your CMRA Report attached."
+MESSAGE_HTML = """\
+    <html>
+    <body>
+        <p>Greetings from Antioch21!<br><br>
+        Thank you for completing the Church Missions Readiness Assessment (CMRA). Attached is your individualized report with your overall readiness score and detailed insights for each domain.<br><br>
+        Inside, you’ll find suggested next steps, space for reflection, and prompts to guide discussion with your church leadership or fellow participants. We encourage you to share and compare your reports if others in your church also completed the CMRA.<br><br>
+        If you’d like to process your results or explore ways to grow in missions readiness, we’d be glad to connect - just reach out at <a href="mailto:admin@antioch21.sg">admin@antioch21.sg</a>.<br><br>
+        Warm regards,<br>
+        Darrell Ong<br>
+        Director Of Partnerships<br>
+        Antioch21
+        </p>
+    </body>
+    </html>
+    """
+# Long base64 lines keep the message small: the longest multiple of 4
+# within the 998 characters a line may have.
+ATTACHMENT_LINE_LENGTH = 996
+# The attachment is base64 encoded this many bytes at a time, making whole
+# lines.
+ATTACHMENT_ENCODE_CHUNK = ATTACHMENT_LINE_LENGTH // 4 * 3 * 64
+
+
+def build_message_body_part():
+    """
+    Returns:
+        bytes: The email's plain text and HTML bodies as one
+            multipart/alternative part, the same for every report.
+    """
+    body = EmailMessage(policy=MESSAGE_POLICY)
+    body.set_content(MESSAGE_TEXT)
+    body.add_alternative(MESSAGE_HTML, subtype="html")
+    del body["MIME-Version"]
+    return body.as_bytes()
+
+
+MESSAGE_BODY_PART = build_message_body_part()
+
+
+def message_header(name, value):
+    return MESSAGE_POLICY.header_factory(name, value).fold(policy=MESSAGE_POLICY)
+
+
+def write_report_message(output, recipient_email, report_path):
+    """
+    Write the report email for a recipient as a MIME message, encoding the
+    report a chunk at a time instead of holding an encoded copy of it.
+
+    Args:
+        output (file): A binary file to write the message to.
+        recipient_email (str): Who the report is for.
+        report_path (str | bytes | file): The path to the report, its PDF
+            bytes, or a binary file to read it from.
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    headers = [
+        message_header("To", recipient_email),
+        message_header("From", MESSAGE_FROM),
+        message_header("Subject", MESSAGE_SUBJECT),
+        "MIME-Version: 1.0\r\n",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n',
+    ]
+    output.write("".join(headers).encode() + b"\r\n")
+    output.write(f"--{boundary}\r\n".encode() + MESSAGE_BODY_PART)
+    output.write(
+        f"\r\n--{boundary}\r\n"
+        "Content-Type: application/pdf\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        'Content-Disposition: attachment; filename="CMRA_Report.pdf"\r\n'
+        "\r\n".encode()
+    )
+
+    if isinstance(report_path, (bytes, bytearray)):
+        report = memoryview(report_path)
+        chunks = (
+            report[start : start + ATTACHMENT_ENCODE_CHUNK]
+            for start in range(0, len(report), ATTACHMENT_ENCODE_CHUNK)
         )
+        write_base64(output, chunks)
+    elif isinstance(report_path, str):
+        with open(report_path, "rb") as report_file:
+            write_base64(output, iter_chunks(report_file))
+    else:
+        write_base64(output, iter_chunks(report_path))
 
-        # Attach report
-        type_subtype, _ = mimetypes.guess_type(report_path)
-        maintype, subtype = type_subtype.split("/")
+    output.write(f"--{boundary}--\r\n".encode())
 
-        with open(report_path, "rb") as fp:
-            attachment_data = fp.read()
-            message.add_attachment(
-                attachment_data, maintype, subtype, filename="CMRA_Report.pdf"
-            )
 
-        # encoded message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+def iter_chunks(report_file):
+    return iter(lambda: report_file.read(ATTACHMENT_ENCODE_CHUNK), b"")
+
+
+def write_base64(output, chunks):
+    for chunk in chunks:
+        encoded = base64.b64encode(chunk)
+        for start in range(0, len(encoded), ATTACHMENT_LINE_LENGTH):
+            output.write(encoded[start : start + ATTACHMENT_LINE_LENGTH] + b"\r\n")
+
+
+@timed_stage("mime_encode")
+def build_report_message(recipient_email, report_path):
+    """
+    Build the report email for a recipient, for the batch endpoint, which
+    only takes messages inline.
+
+    Args:
+        recipient_email (str): Who the report is for.
+        report_path (str | bytes | file): The path to the report, its PDF
+            bytes, or a binary file to read it from.
+
+    Returns:
+        dict: The Gmail API message body, with the encoded message under "raw".
+    """
+    message = io.BytesIO()
+    write_report_message(message, recipient_email, report_path)
+    return {"raw": base64.urlsafe_b64encode(message.getbuffer()).decode()}
+
+
+@timed_stage("mime_encode")
+def spool_report_message(recipient_email, report_path):
+    """
+    Write the report email for a recipient to a temporary file for a media
+    upload. The file stays in memory up to one upload chunk and moves to
+    disk beyond that.
+
+    Returns:
+        tempfile.SpooledTemporaryFile: The message, to be closed once sent.
+    """
+    message_file = tempfile.SpooledTemporaryFile(max_size=GMAIL_UPLOAD_CHUNK_SIZE)
+    try:
+        write_report_message(message_file, recipient_email, report_path)
+    except BaseException:
+        message_file.close()
+        raise
+    return message_file
+
 
-        create_message = {"raw": encoded_message}
-        # pylint: disable=E1101
-        send_message = (
-            service.users().messages().send(userId="me", body=create_message).execute()
+def new_upload_request(service, message_file):
+    """
+    Returns:
+        HttpRequest: A messages.send request that uploads the message file as
+            media: in a single request if it fits in one upload chunk, or
+            as a resumable upload of GMAIL_UPLOAD_CHUNK_SIZE chunks.
+    """
+    size = message_file.seek(0, io.SEEK_END)
+    message_file.seek(0)
+    media = MediaIoBaseUpload(
+        message_file,
+        mimetype="message/rfc822",
+        chunksize=GMAIL_UPLOAD_CHUNK_SIZE,
+        resumable=size > GMAIL_UPLOAD_CHUNK_SIZE,
+    )
+    # pylint: disable=E1101
+    request = service.users().messages().send(userId="me", media_body=media)
+    if GMAIL_API_ENDPOINT:
+        # googleapiclient only moves upload URLs to the endpoint's host, not
+        # its scheme.
+        endpoint = urllib.parse.urlparse(GMAIL_API_ENDPOINT)
+        request.uri = urllib.parse.urlunparse(
+            urllib.parse.urlparse(request.uri)._replace(
+                scheme=endpoint.scheme, netloc=endpoint.netloc
+            )
         )
+    return request
+
+
+@timed_stage("gmail_send")
+def gmail_send_message(recipient_email, report_path):
+    """Create and send an email message
+    Print the returned  message id
+    Returns: Message object, including message id
+
+    `report_path` may also be the report's PDF bytes, as produced by an
+    in-memory report, or a binary file to read it from.
+
+    The message is uploaded as media rather than base64 encoded into a JSON
+    body, and only ever held in memory one upload chunk at a time.
+
+    The send goes through the send scheduler, which rate limits it and
+    retries it if Gmail rate limits it (429) or fails (5xx).
+
+    Load pre-authorized user credentials from the environment.
+    TODO(developer) - See https://developers.google.com/identity
+    for guides on implementing OAuth2 for the application.
+    """
+    try:
+        service = get_gmail_service()
+        with spool_report_message(recipient_email, report_path) as message_file:
+            # Each attempt starts a new upload from the top of the message.
+            send_message = get_send_scheduler().send(
+                lambda: new_upload_request(service, message_file).execute()
+            )
         print(f"Message Id: {send_message['id']}")
+        EMAILS_SENT.inc()
     except HttpError as error:
         print(f"An error occurred: {error}")
+        EMAIL_FAILURES.inc()
         send_message = None
     return send_message
 
 
+async def gmail_send_message_async(recipient_email, report_path):
+    """
+    Like `gmail_send_message`, but uploads the message on the event loop
+    with aiohttp, so any number of sends can wait on Gmail at once without a
+    thread each. Still goes through the send scheduler.
+
+    Returns:
+        dict | None: The sent message, or None if Gmail rejected it.
+    """
+    with timed_stage("gmail_send"):
+        try:
+            message_file = await asyncio.to_thread(
+                spool_report_message, recipient_email, report_path
+            )
+            with message_file:
+                send_message = await get_send_scheduler().send_async(
+                    lambda: upload_message_async(message_file)
+                )
+            print(f"Message Id: {send_message['id']}")
+            EMAILS_SENT.inc()
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            EMAIL_FAILURES.inc()
+            send_message = None
+        return send_message
+
+
+async def upload_message_async(message_file):
+    """
+    Send a spooled message with a media upload: in a single request if it
+    fits in one upload chunk, otherwise as a resumable upload of
+    GMAIL_UPLOAD_CHUNK_SIZE chunks, so only one chunk is in memory at once.
+
+    Returns:
+        dict: The sent message.
+
+    Raises:
+        HttpError: If Gmail rejected the upload, like googleapiclient would.
+        ConnectionError: If the connection failed.
+    """
+    size = message_file.seek(0, io.SEEK_END)
+    message_file.seek(0)
+    url = f"{GMAIL_API_BASE_URL}/upload/gmail/v1/users/me/messages/send"
+    headers = {}
+    if not GMAIL_API_ENDPOINT:
+        creds = await get_credentials_async()
+        headers["Authorization"] = f"Bearer {creds.token}"
+    session = get_http_session()
+
+    try:
+        if size <= GMAIL_UPLOAD_CHUNK_SIZE:
+            async with session.post(
+                url,
+                params={"uploadType": "media"},
+                data=message_file.read(),
+                headers={**headers, "Content-Type": "message/rfc822"},
+                timeout=GMAIL_REQUEST_TIMEOUT,
+            ) as response:
+                return await gmail_response_json(response)
+
+        async with session.post(
+            url,
+            params={"uploadType": "resumable"},
+            headers={
+                **headers,
+                "X-Upload-Content-Type": "message/rfc822",
+                "X-Upload-Content-Length": str(size),
+            },
+            timeout=GMAIL_REQUEST_TIMEOUT,
+        ) as response:
+            await gmail_response_json(response, expect_body=False)
+            upload_url = response.headers["Location"]
+
+        offset = 0
+        while True:
+            message_file.seek(offset)
+            chunk = message_file.read(GMAIL_UPLOAD_CHUNK_SIZE)
+            content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+            async with session.put(
+                upload_url,
+                data=chunk,
+                headers={**headers, "Content-Range": content_range},
+                timeout=GMAIL_REQUEST_TIMEOUT,
+            ) as response:
+                if response.status != 308:
+                    return await gmail_response_json(response)
+                # Continue from what Gmail says it has received.
+                received = response.headers.get("Range", "").rpartition("-")[2]
+                offset = int(received) + 1 if received else 0
+    except aiohttp.ClientConnectionError as error:
+        raise ConnectionError(str(error)) from error
+
+
+async def gmail_response_json(response, expect_body=True):
+    """
+    Returns:
+        dict | None: The response's JSON body.
+
+    Raises:
+        HttpError: If the response is an error, with its status and headers,
+            so the send scheduler treats it like a googleapiclient error.
+    """
+    content = await response.read()
+    if response.status >= 400:
+        info = {name.lower(): value for name, value in response.headers.items()}
+        info["status"] = response.status
+        raise HttpError(httplib2.Response(info), content, uri=str(response.url))
+    return json.loads(content) if expect_body else None
+
+
+@timed_stage("gmail_send_batch")
+def gmail_send_messages(reports, batch_size=GMAIL_BATCH_SIZE):
+    """Send many report emails through the Gmail batch endpoint
+
+    Args:
+        reports (list): (recipient_email, report_path) pairs, where
+            report_path may also be the report's PDF bytes.
+        batch_size (int): The most messages to send in one batch request.
+
+    Each batch goes through the send scheduler, which rate limits it by its
+    number of messages. Messages within a batch that Gmail rate limits (429)
+    or fails (5xx) are sent again in a smaller batch after a backoff.
+
+    Returns:
+        list: The sent message for each report, in order, or None for each
+            report that failed to send.
+    """
+    service = get_gmail_service()
+    scheduler = get_send_scheduler()
+    sent_messages = [None] * len(reports)
+    retry_errors = {}
+
+    def on_sent(request_id, response, exception):
+        if exception is not None:
+            if is_retryable(exception):
+                retry_errors[int(request_id)] = exception
+                return
+            print(f"An error occurred sending report {request_id}: {exception}")
+            EMAIL_FAILURES.inc()
+            return
+        sent_messages[int(request_id)] = response
+        print(f"Message Id: {response['id']}")
+        EMAILS_SENT.inc()
+
+    for start in range(0, len(reports), batch_size):
+        messages = {
+            index: build_report_message(*reports[index])
+            for index in range(start, min(start + batch_size, len(reports)))
+        }
+        pending = list(messages)
+        attempt = 1
+        while pending:
+            batch = new_batch_request(service, on_sent)
+            for index in pending:
+                # pylint: disable=E1101
+                batch.add(
+                    service.users().messages().send(userId="me", body=messages[index]),
+                    request_id=str(index),
+                )
+            retry_errors.clear()
+            try:
+                scheduler.send(batch.execute, count=len(pending))
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+                EMAIL_FAILURES.inc(len(pending))
+                break
+
+            pending = sorted(retry_errors)
+            if not pending:
+                break
+            if attempt >= scheduler.max_attempts:
+                for index in pending:
+                    print(
+                        f"An error occurred sending report {index}: "
+                        f"{retry_errors[index]}"
+                    )
+                EMAIL_FAILURES.inc(len(pending))
+                break
+            scheduler.wait_to_retry(
+                attempt, next(iter(retry_errors.values())), len(pending)
+            )
+            attempt += 1
+
+    return sent_messages
+
+
 if __name__ == "__main__":
     gmail_send_message()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+
+import aiohttp
+
+# Outbound connections the shared HTTP session keeps open at once, across
+# Typeform and Gmail.
+HTTP_CONNECTION_LIMIT = int(os.getenv("HTTP_CONNECTION_LIMIT", "64"))
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a background thread, where this process
+    does its outbound HTTP. Synchronous code hands it coroutines with
+    `submit` or `run`, so waiting on Typeform or Gmail never ties up a
+    gunicorn worker's threads.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._session = None
+        self._thread = threading.Thread(
+            target=self._run, name="event-loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """
+        Schedule a coroutine on the loop.
+
+        Returns:
+            concurrent.futures.Future: The coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the loop and wait for its result.
+        """
+        return self.submit(coroutine).result(timeout)
+
+    def http_session(self):
+        """
+        Returns:
+            aiohttp.ClientSession: The loop's shared session, pooling
+                keep-alive connections. Only use it on the loop.
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT)
+            )
+        return self._session
+
+    def stop(self, timeout=10):
+        async def close():
+            # Background tasks (queue consumers, flushers) end with the loop.
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._session is not None:
+                await self._session.close()
+
+        if self.loop.is_running():
+            try:
+                self.run(close(), timeout)
+            finally:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join(timeout)
+
+
+_event_loop_thread = None
+_event_loop_thread_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+    """
+    Returns:
+        EventLoopThread: This process's event loop, started on first use.
+    """
+    global _event_loop_thread
+    with _event_loop_thread_lock:
+        if _event_loop_thread is None:
+            _event_loop_thread = EventLoopThread()
+        return _event_loop_thread
+
+
+def get_http_session():
+    """
+    Returns:
+        aiohttp.ClientSession: This process's shared HTTP session. Only use
+            it from coroutines running on `get_event_loop_thread()`.
+    """
+    return get_event_loop_thread().http_session()
+
+
+def stop_event_loop():
+    global _event_loop_thread
+    with _event_loop_thread_lock:
+        if _event_loop_thread is not None:
+            _event_loop_thread.stop()
+            _event_loop_thread = None
@@ -1,30 +1,156 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from enum import Enum
 
+import aiohttp
+import orjson
 import requests
 from dotenv import load_dotenv
 
-from interfaces.form_response import FormResponse
+from event_loop_module import get_event_loop_thread, get_http_session
+from interfaces.form_response import FormResponse, FormResponsePage
+from metrics_module import timed_stage
 
 load_dotenv()
 
 CMRA_FORM_ID = "SKFDhMKo"
 CMRA_WEBHOOK_NAME = "cmra_webhook"
+# Can point at the local stand-in in stand_in_services.py for load testing.
+TYPEFORM_API_BASE_URL = os.getenv("TYPEFORM_API_BASE_URL", "https://api.typeform.com")
+TYPEFORM_REQUEST_TIMEOUT = 60
 
+WebhookEvents = Enum(
+    "WebhookEvents",
+    [
+        # A submitted response: its report is rendered and emailed.
+        ("form_response", "form_response"),
+        # An unfinished response, delivered as it is being filled in.
+        ("form_response_partial", "form_response_partial"),
+    ],
+)
 
-def retrieve_form_responses(since=None, until=None, page_size=1000):
+
+@timed_stage("typeform_page")
+def retrieve_form_responses_page(since=None, until=None, page_size=1000, before=None):
     """
-    Retrieves all CMRA form responses from Typeform.
+    Retrieves a single page of CMRA form responses from Typeform, newest first.
+
+    Args:
+        before (str, optional): Only return responses submitted before the
+            response with this token.
 
     Returns:
-        list: A list of dictionaries containing the form responses.
+        dict: The page, with the responses under "items".
     """
-    access_token = os.getenv("TYPEFORM_PERSONAL_ACCESS_TOKEN")
-    get_all_responses_url = f"https://api.typeform.com/forms/{CMRA_FORM_ID}/responses"
-    headers = {"Authorization": f"Bearer {access_token}"}
+    content = get_event_loop_thread().run(
+        fetch_form_responses_page(since, until, page_size, before)
+    )
+
+    # orjson parses a full 1000-response page several times faster than json.
+    return orjson.loads(content)
+
+
+async def fetch_form_responses_page(
+    since=None, until=None, page_size=1000, before=None
+):
+    """
+    Fetches a single page of CMRA form responses from Typeform on the event
+    loop, over the process's pooled keep-alive connections.
+
+    Returns:
+        bytes: The page's JSON body.
+    """
+    get_all_responses_url = f"{TYPEFORM_API_BASE_URL}/forms/{CMRA_FORM_ID}/responses"
     params = {"since": since, "until": until, "page_size": page_size}
-    responses = requests.get(get_all_responses_url, headers=headers, params=params)
+    if before:
+        params["before"] = before
+    async with get_http_session().get(
+        get_all_responses_url,
+        params={key: value for key, value in params.items() if value is not None},
+        headers={
+            "Authorization": f"Bearer {os.getenv('TYPEFORM_PERSONAL_ACCESS_TOKEN')}"
+        },
+        timeout=aiohttp.ClientTimeout(total=TYPEFORM_REQUEST_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+def iter_form_response_pages(since=None, until=None, page_size=1000, prefetch=False):
+    """
+    Yields every page of CMRA form responses from Typeform.
+
+    Pages are followed with Typeform's `before` token until a short page is
+    returned, so only one page (two when prefetching) is held in memory.
+
+    Args:
+        prefetch (bool): Fetch the next page in the background while the
+            current page is being consumed.
+
+    Yields:
+        list: The raw responses on the page.
+    """
+
+    def fetch_page(before):
+        return retrieve_form_responses_page(
+            since=since, until=until, page_size=page_size, before=before
+        )
+
+    with ThreadPoolExecutor(max_workers=1) if prefetch else nullcontext() as pool:
+        page = fetch_page(None)
+        while True:
+            items = page.get("items", [])
+            has_next_page = len(items) >= page_size
+            next_page = None
+            if has_next_page and pool:
+                next_page = pool.submit(fetch_page, items[-1]["token"])
+
+            yield items
+
+            if not has_next_page:
+                return
+            page = next_page.result() if next_page else fetch_page(items[-1]["token"])
+
+
+def iter_form_responses(since=None, until=None, page_size=1000, prefetch=False):
+    """
+    Yields every CMRA form response from Typeform, one at a time.
+
+    Yields:
+        dict: The raw response data from Typeform.
+    """
+    for items in iter_form_response_pages(since, until, page_size, prefetch):
+        yield from items
+
+
+def iter_parsed_form_responses(since=None, until=None, page_size=1000, prefetch=False):
+    """
+    Yields every CMRA form response from Typeform, parsed.
+
+    Each page is parsed in one pass into columns (see `parse_form_responses_page`)
+    and a FormResponse is only built for a response when it is reached.
 
-    return responses.json()
+    Yields:
+        FormResponse: The parsed response.
+    """
+    for items in iter_form_response_pages(since, until, page_size, prefetch):
+        yield from parse_form_responses_page(items)
+
+
+@timed_stage("typeform_retrieve")
+def retrieve_form_responses(since=None, until=None, page_size=1000):
+    """
+    Retrieves all CMRA form responses from Typeform, across every page.
+
+    Prefer `iter_form_responses` for large result sets.
+
+    Returns:
+        dict: All form responses under "items".
+    """
+    items = list(iter_form_responses(since=since, until=until, page_size=page_size))
+
+    return {"total_items": len(items), "items": items}
 
 
 def register_form_webhook():
@@ -36,7 +162,7 @@ def register_form_webhook():
     """
     access_token = os.getenv("TYPEFORM_PERSONAL_ACCESS_TOKEN")
     register_webhook_url = (
-        f"https://api.typeform.com/forms/{CMRA_FORM_ID}/webhooks/{CMRA_WEBHOOK_NAME}"
+        f"{TYPEFORM_API_BASE_URL}/forms/{CMRA_FORM_ID}/webhooks/{CMRA_WEBHOOK_NAME}"
     )
     headers = {
         "Authorization": f"Bearer {access_token}",
@@ -46,7 +172,7 @@ def register_form_webhook():
     webhook_data = {
         "url": f"{os.getenv('APP_URL')}/webhook",
         "enabled": True,
-        "event": ["form_response", "form_response_partial"],
+        "event": [event.value for event in WebhookEvents],
     }
 
     response = requests.put(register_webhook_url, headers=headers, json=webhook_data)
@@ -68,6 +194,73 @@ def parse_raw_response(raw_response):
     return FormResponse(raw_response)
 
 
+@timed_stage("parse_page")
+def parse_form_responses_page(page):
+    """
+    Parses a page of raw responses from Typeform in bulk.
+
+    Args:
+        page (list | bytes | str): The page's raw responses, or the page's
+            JSON body as returned by the Typeform responses API.
+
+    Returns:
+        FormResponsePage: The responses' answers and scores as columns.
+    """
+    if isinstance(page, (bytes, str)):
+        page = orjson.loads(page)["items"]
+
+    return FormResponsePage(page)
+
+
+def webhook_event(data):
+    """
+    Returns:
+        WebhookEvents | None: The kind of webhook delivery, or None if it is
+            not one this server handles. Deliveries without an event_type are
+            treated as submitted responses.
+    """
+    event_type = data.get("event_type", WebhookEvents.form_response.value)
+    try:
+        return WebhookEvents(event_type)
+    except ValueError:
+        return None
+
+
+def is_valid_webhook_payload(data):
+    """
+    Checks that a webhook payload carries a form response that can be
+    handled: a submitted response that can be parsed, or a partial response
+    with a token to merge its deliveries by.
+
+    Args:
+        data (dict): The JSON body of a Typeform webhook delivery.
+
+    Returns:
+        bool: True if the payload can be queued for report generation,
+            recorded as a partial response, or is an event type this server
+            ignores.
+    """
+    if not isinstance(data, dict) or not data.get("event_id"):
+        return False
+
+    event = webhook_event(data)
+    if event is None:
+        # Acknowledged and ignored, so Typeform does not retry it
+        return True
+    raw_response = data.get("form_response")
+    if not isinstance(raw_response, dict):
+        return False
+    if event == WebhookEvents.form_response_partial:
+        return bool(raw_response.get("token")) and isinstance(
+            raw_response.get("answers", []), list
+        )
+    return (
+        "submitted_at" in raw_response
+        and isinstance(raw_response.get("answers"), list)
+        and isinstance(raw_response.get("variables"), list)
+    )
+
+
 if __name__ == "__main__":
     # responses = retrieve_form_responses()
     # print(responses)
@@ -0,0 +1,223 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+import fitz
+from markdown_pdf import MarkdownPdf, Section
+
+FRAGMENT_CACHE_DIR = os.getenv("FRAGMENT_CACHE_DIR", "data/fragments")
+# Bump when the way fragments are measured or stored changes.
+FRAGMENT_FORMAT_VERSION = 1
+
+
+class FragmentLibrary:
+    """
+    A set of markdown snippets rendered once into a PDF, ready to be stamped
+    onto report pages with `show_pdf_page` instead of being laid out again.
+
+    Fragment keys are "<group>:<name>" strings. The vertical gap between two
+    fragments is measured per pair of groups from a reference layout, so
+    stacked fragments are spaced as markdown-pdf would have spaced them.
+    """
+
+    def __init__(self, document, index, gaps, top):
+        self.document = document
+        self.index = index
+        self.gaps = gaps
+        self.top = top
+
+    @classmethod
+    def compile(cls, fragments, reference, css, anchor_labels=()):
+        """
+        Render and measure a set of fragments.
+
+        Args:
+            fragments (dict): Markdown for each fragment key.
+            reference (list): Fragment keys laid out together once to measure
+                the gap between each pair of fragment groups.
+            css (str): The CSS every fragment is rendered with.
+            anchor_labels (iterable): Labels (e.g. "Score:") whose end position
+                is recorded so per-report values can be written after them.
+
+        Returns:
+            FragmentLibrary: The compiled fragments.
+        """
+        keys = list(fragments)
+        pdf = MarkdownPdf(toc_level=0)
+        for key in keys:
+            pdf.add_section(Section(fragments[key], toc=False), user_css=css)
+        pdf.add_section(
+            Section("".join(fragments[key] for key in reference), toc=False),
+            user_css=css,
+        )
+        compiled = io.BytesIO()
+        pdf.save(compiled)
+        document = fitz.open("pdf", compiled.getvalue())
+
+        index = {}
+        for page_number, key in enumerate(keys):
+            page = document[page_number]
+            items = layout_items(page)
+            clip = fitz.Rect()
+            for item in items:
+                clip |= item
+            index[key] = {
+                "page": page_number,
+                "clip": list(clip),
+                "items": len(items),
+                "anchors": find_anchors(page, anchor_labels, clip),
+            }
+
+        # Split the reference page's items between its fragments in order.
+        reference_items = layout_items(document[len(keys)])
+        bounds = []
+        for key in reference:
+            count = index[key]["items"]
+            rect = fitz.Rect()
+            for item in reference_items[:count]:
+                rect |= item
+            reference_items = reference_items[count:]
+            bounds.append(rect)
+
+        gaps = {}
+        for (key, rect), (next_key, next_rect) in zip(
+            zip(reference, bounds), zip(reference[1:], bounds[1:])
+        ):
+            gaps[f"{group(key)}>{group(next_key)}"] = next_rect.y0 - rect.y1
+
+        document.delete_page(len(keys))
+        document = fitz.open("pdf", document.tobytes(garbage=3, deflate=True))
+        return cls(document, index, gaps, bounds[0].y0)
+
+    def save(self, path):
+        # Write then rename so other workers never load a partial library; the
+        # index is written last because its presence marks the library as ready.
+        temp_suffix = f".{os.getpid()}.tmp"
+        self.document.save(f"{path}.pdf{temp_suffix}")
+        os.replace(f"{path}.pdf{temp_suffix}", f"{path}.pdf")
+        with open(f"{path}.json{temp_suffix}", "w") as index_file:
+            json.dump(
+                {"index": self.index, "gaps": self.gaps, "top": self.top}, index_file
+            )
+        os.replace(f"{path}.json{temp_suffix}", f"{path}.json")
+
+    @classmethod
+    def load(cls, path):
+        with open(f"{path}.json") as index_file:
+            data = json.load(index_file)
+        document = fitz.open(f"{path}.pdf")
+        return cls(document, data["index"], data["gaps"], data["top"])
+
+    def gap(self, key, next_key):
+        return self.gaps.get(f"{group(key)}>{group(next_key)}", 0)
+
+    def place(self, page, key, top):
+        """
+        Stamp a fragment onto a page.
+
+        Args:
+            page (fitz.Page): The page to draw on.
+            key (str): The fragment to place.
+            top (float): The y coordinate of the fragment's top edge.
+
+        Returns:
+            tuple: The fragment's placed rectangle and its anchors, each as
+                an (x, baseline, font size) tuple in page coordinates.
+        """
+        fragment = self.index[key]
+        clip = fitz.Rect(fragment["clip"])
+        target = fitz.Rect(clip.x0, top, clip.x1, top + clip.height)
+        page.show_pdf_page(target, self.document, fragment["page"], clip=clip)
+
+        anchors = {
+            label: (x, top + offset, size)
+            for label, (x, offset, size) in fragment["anchors"].items()
+        }
+        return target, anchors
+
+
+def group(key):
+    return key.split(":", 1)[0]
+
+
+def layout_items(page):
+    """
+    Returns:
+        list: The bounding boxes of a page's text lines and drawings, top to
+            bottom.
+    """
+    items = [
+        fitz.Rect(line["bbox"])
+        for block in page.get_text("dict")["blocks"]
+        for line in block.get("lines", [])
+    ]
+    items += [drawing["rect"] for drawing in page.get_drawings()]
+    return sorted(items, key=lambda rect: (rect.y0, rect.x0))
+
+
+def find_anchors(page, labels, clip):
+    anchors = {}
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                label = span["text"].strip()
+                if label in labels:
+                    anchors[label] = (
+                        span["bbox"][2],
+                        span["origin"][1] - clip.y0,
+                        span["size"],
+                    )
+    return anchors
+
+
+def fragments_digest(fragments, reference, css):
+    """
+    Returns:
+        str: A hash of everything the compiled fragments depend on, so any
+            change to the content (e.g. content/summary_text.py) invalidates
+            previously compiled fragments.
+    """
+    encoded = json.dumps(
+        [FRAGMENT_FORMAT_VERSION, fitz.VersionBind, fragments, reference, css],
+        sort_keys=True,
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_fragment_library(
+    fragments, reference, css, anchor_labels=(), cache_dir=FRAGMENT_CACHE_DIR
+):
+    """
+    Return the compiled fragment library for a set of fragments.
+
+    Libraries are kept in memory per process and on disk under a digest of
+    their content, so they are only compiled again when the content changes.
+
+    Returns:
+        FragmentLibrary: The compiled fragments.
+    """
+    digest = fragments_digest(fragments, reference, css)
+
+    with _libraries_lock:
+        library = _libraries.get(digest)
+        if library is not None:
+            return library
+
+        path = os.path.join(cache_dir, digest) if cache_dir else None
+        if path and os.path.exists(f"{path}.json"):
+            library = FragmentLibrary.load(path)
+        else:
+            print(f"Compiling {len(fragments)} report fragments...")
+            library = FragmentLibrary.compile(fragments, reference, css, anchor_labels)
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                library.save(path)
+
+        _libraries[digest] = library
+        return library
@@ -1,2 +1,88 @@
+import os
+import shutil
+import time
+
+STARTED_AT = time.monotonic()
+
 bind = "0.0.0.0:8080"
 workers = 2
+
+# Import the app and its libraries in the master, so forked workers share
+# them copy-on-write instead of each importing their own copy. Reports are
+# rendered in each worker's render processes, which load the report
+# dependencies themselves (render_pool_module). Set PRELOAD_BEFORE_FORK=false
+# to import them in each worker instead.
+PRELOAD_BEFORE_FORK = os.getenv("PRELOAD_BEFORE_FORK", "true").lower() == "true"
+
+# Workers share their metrics through files in this directory. It has to be
+# set before prometheus_client is first imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "data/metrics")
+# Each worker renders on its own pool of processes; split the cores between
+# them.
+os.environ.setdefault("RENDER_PROCESSES", str(max(1, (os.cpu_count() or 1) // workers)))
+# Each worker has its own Gmail send rate limit; split the account's quota
+# (2.5 messages a second) between them.
+os.environ.setdefault("GMAIL_SEND_RATE", str(2.5 / workers))
+
+
+def preload_pipeline():
+    # Flask and the app's routes, the Gmail client and the job queue.
+    import app
+    import pipeline_module
+
+
+def on_starting(server):
+    # Start from an empty metrics directory; files left by a previous run
+    # would otherwise be added to this run's totals.
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+    if PRELOAD_BEFORE_FORK:
+        preload_pipeline()
+
+
+def when_ready(server):
+    from metrics_module import record_startup
+
+    record_startup("master", time.monotonic() - STARTED_AT)
+
+
+def pre_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_fork(server, worker):
+    if not PRELOAD_BEFORE_FORK:
+        preload_pipeline()
+
+    # Start this worker's job queue consumer on its event loop. Reports are
+    # rendered on the worker's render processes (render_pool_module), each
+    # with its own warm Kaleido browser; they start with the first job.
+    from job_queue_module import get_job_queue
+
+    get_job_queue()
+
+
+def post_worker_init(worker):
+    from metrics_module import record_startup
+
+    record_startup("worker", time.monotonic() - worker.forked_at)
+
+
+def worker_exit(server, worker):
+    from event_loop_module import stop_event_loop
+    from job_queue_module import get_job_queue
+    from partial_response_module import flush_partial_responses
+    from render_pool_module import shutdown_render_pool
+
+    get_job_queue().stop_workers()
+    flush_partial_responses()
+    shutdown_render_pool()
+    stop_event_loop()
+
+
+def child_exit(server, worker):
+    from metrics_module import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -1,5 +1,7 @@
 from enum import Enum
 
+import numpy as np
+
 FieldIds = Enum(
     "FieldIds",
     [
@@ -11,6 +13,12 @@ FieldIds = Enum(
 )
 
 
+# Answer field names by Typeform field id, so answers are matched with one
+# dict lookup instead of an Enum lookup that raises for unrelated questions.
+ANSWER_FIELD_INDEX = {field.value: field.name for field in FieldIds}
+ANSWER_FIELDS = [field.name for field in FieldIds]
+
+
 class FormResponseAnswersFields:
     def __init__(self, **kwargs):
         self.respondent = kwargs.get("respondent")
@@ -19,74 +27,342 @@ class FormResponseAnswersFields:
         self.church = kwargs.get("church")
 
 
+# Fixed positions of every score in a score vector.
+DOMAINS = ["discipleship", "sending", "support", "structure"]
+SUBDOMAINS = [
+    "education",
+    "training",
+    "sending1",
+    "membercare",
+    "praying",
+    "giving",
+    "community",
+    "organisation",
+    "policies",
+    "partnerships",
+]
+SCORE_FIELDS = DOMAINS + SUBDOMAINS + ["score", "finalpercentage"]
+SCORE_INDEX = {name: index for index, name in enumerate(SCORE_FIELDS)}
+DOMAIN_SLICE = slice(0, len(DOMAINS))
+SUBDOMAIN_SLICE = slice(len(DOMAINS), len(DOMAINS) + len(SUBDOMAINS))
+
+# Domain scores are out of 25; sub-domain scores are already percentages.
+DOMAIN_MAX_SCORE = 25
+STAGE_COUNT = 5
+
+
+def calculate_stages(percentages):
+    """
+    Returns:
+        numpy.ndarray: The stage (1 to 5) of each percentage.
+    """
+    stages = np.floor((percentages / 100) * STAGE_COUNT)
+    return np.where(stages > 0, stages, 1).astype(int)
+
+
+def rank_subdomains(values):
+    """
+    Returns:
+        numpy.ndarray: Sub-domain indices from strongest to weakest along the
+            last axis. Equal scores keep their sub-domain order.
+    """
+    return np.argsort(-values[..., SUBDOMAIN_SLICE], axis=-1, kind="stable")
+
+
 class FormResponseScores:
+    """
+    A response's scores as one vector with fixed positions (see
+    SCORE_FIELDS). Domain percentages, stages and the sub-domain ranking are
+    computed once, vectorised, when the scores are created.
+
+    Scores are still readable as attributes, e.g. `scores.education`, with
+    the value exactly as Typeform sent it (None if it was missing).
+    """
+
+    __slots__ = (
+        "raw",
+        "values",
+        "domain_percentages",
+        "domain_stages",
+        "subdomain_stages",
+        "subdomain_ranking",
+    )
+
     def __init__(self, **kwargs):
-        # Domain 1: Discipleship
-        self.discipleship = kwargs.get("discipleship")
-        self.education = kwargs.get("education")
-        self.training = kwargs.get("training")
-
-        # Domain 2: Sending
-        self.sending = kwargs.get("sending")
-        self.sending1 = kwargs.get("sending1")
-        self.membercare = kwargs.get("membercare")
-
-        # Domain 3: Support
-        self.support = kwargs.get("support")
-        self.praying = kwargs.get("praying")
-        self.giving = kwargs.get("giving")
-        self.community = kwargs.get("community")
-
-        # Domain 4: Structure
-        self.structure = kwargs.get("structure")
-        self.organisation = kwargs.get("organisation")
-        self.policies = kwargs.get("policies")
-        self.partnerships = kwargs.get("partnerships")
-
-        ranked_scores = [
-            ("education", self.education),
-            ("training", self.training),
-            ("sending1", self.sending1),
-            ("membercare", self.membercare),
-            ("praying", self.praying),
-            ("giving", self.giving),
-            ("community", self.community),
-            ("organisation", self.organisation),
-            ("policies", self.policies),
-            ("partnerships", self.partnerships),
+        raw = tuple(kwargs.get(name) for name in SCORE_FIELDS)
+        values = np.array(
+            [np.nan if value is None else value for value in raw], dtype=float
+        )
+        self._set(raw, values)
+
+    @classmethod
+    def from_vector(
+        cls,
+        raw,
+        values,
+        domain_percentages,
+        domain_stages,
+        subdomain_stages,
+        subdomain_ranking,
+    ):
+        scores = cls.__new__(cls)
+        scores.raw = raw
+        scores.values = values
+        scores.domain_percentages = domain_percentages
+        scores.domain_stages = domain_stages
+        scores.subdomain_stages = subdomain_stages
+        scores.subdomain_ranking = subdomain_ranking
+        return scores
+
+    def _set(self, raw, values):
+        self.raw = raw
+        self.values = values
+        self.domain_percentages = (values[DOMAIN_SLICE] / DOMAIN_MAX_SCORE) * 100
+        self.domain_stages = calculate_stages(self.domain_percentages)
+        self.subdomain_stages = calculate_stages(values[SUBDOMAIN_SLICE])
+        self.subdomain_ranking = rank_subdomains(values)
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots.
+        if name in SCORE_INDEX:
+            return self.raw[SCORE_INDEX[name]]
+        raise AttributeError(name)
+
+    def domain_percentage(self, domain):
+        return float(self.domain_percentages[DOMAINS.index(domain)])
+
+    def domain_stage(self, domain):
+        return int(self.domain_stages[DOMAINS.index(domain)])
+
+    def subdomain_stage(self, subdomain):
+        return int(self.subdomain_stages[SUBDOMAINS.index(subdomain)])
+
+    def strongest_subdomains(self, count=3):
+        """
+        Returns:
+            list: (sub-domain, score) pairs from the strongest down.
+        """
+        return [
+            (SUBDOMAINS[index], self.raw[SUBDOMAIN_SLICE][index])
+            for index in self.subdomain_ranking[:count]
+        ]
+
+    def weakest_subdomains(self, count=3):
+        """
+        Returns:
+            list: (sub-domain, score) pairs from the weakest up.
+        """
+        return [
+            (SUBDOMAINS[index], self.raw[SUBDOMAIN_SLICE][index])
+            for index in self.subdomain_ranking[::-1][:count]
+        ]
+
+    @property
+    def top_3_strongest_subdomains(self):
+        return self.strongest_subdomains(3)
+
+    @property
+    def bottom_3_weakest_subdomains(self):
+        return self.weakest_subdomains(3)
+
+
+class FormResponseScoresBatch:
+    """
+    The scores of many responses as one matrix, one row per response, with
+    percentages, stages and rankings computed for every row at once.
+    """
+
+    __slots__ = (
+        "raw",
+        "values",
+        "domain_percentages",
+        "domain_stages",
+        "subdomain_stages",
+        "subdomain_ranking",
+    )
+
+    def __init__(self, scores_list):
+        """
+        Args:
+            scores_list (iterable): FormResponseScores, or dicts of score
+                values keyed by name (as from `map_scores_args`).
+        """
+        raw = [
+            (
+                scores.raw
+                if isinstance(scores, FormResponseScores)
+                else tuple(scores.get(name) for name in SCORE_FIELDS)
+            )
+            for scores in scores_list
         ]
-        ranked_scores.sort(key=lambda x: x[1], reverse=True)
+        values = np.array(
+            [[np.nan if value is None else value for value in row] for row in raw],
+            dtype=float,
+        ).reshape(len(raw), len(SCORE_FIELDS))
+        self._set(raw, values)
+
+    @classmethod
+    def from_matrix(cls, raw, values):
+        """
+        Args:
+            raw (list): Each response's scores as Typeform sent them, as
+                tuples in SCORE_FIELDS order.
+            values (numpy.ndarray): The same scores as floats, NaN if missing.
+        """
+        batch = cls.__new__(cls)
+        batch._set(raw, values)
+        return batch
+
+    def _set(self, raw, values):
+        self.raw = raw
+        self.values = values
+        self.domain_percentages = (
+            self.values[:, DOMAIN_SLICE] / DOMAIN_MAX_SCORE
+        ) * 100
+        self.domain_stages = calculate_stages(self.domain_percentages)
+        self.subdomain_stages = calculate_stages(self.values[:, SUBDOMAIN_SLICE])
+        self.subdomain_ranking = rank_subdomains(self.values)
+
+    @classmethod
+    def from_raw_responses(cls, raw_responses):
+        """
+        Args:
+            raw_responses (iterable): Raw responses from Typeform.
+        """
+        return cls(
+            FormResponse.map_scores_args(raw_response["variables"])
+            for raw_response in raw_responses
+        )
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, index):
+        return FormResponseScores.from_vector(
+            self.raw[index],
+            self.values[index],
+            self.domain_percentages[index],
+            self.domain_stages[index],
+            self.subdomain_stages[index],
+            self.subdomain_ranking[index],
+        )
+
+    def column(self, name):
+        """
+        Returns:
+            numpy.ndarray: One score across every response.
+        """
+        return self.values[:, SCORE_INDEX[name]]
 
-        self.top_3_strongest_subdomains = [ranked_scores[i] for i in range(3)]
-        self.bottom_3_weakest_subdomains = [
-            ranked_scores[i]
-            for i in range(len(ranked_scores) - 1, len(ranked_scores) - 4, -1)
+
+class FormResponsePage:
+    """
+    A page of Typeform responses parsed in bulk into columns: one list per
+    answer field and one score matrix (see FormResponseScoresBatch).
+
+    FormResponse views of single responses are only built when indexed or
+    iterated.
+    """
+
+    __slots__ = ("tokens", "submitted_at", "answers", "scores")
+
+    def __init__(self, raw_responses):
+        """
+        Args:
+            raw_responses (list): Raw responses from Typeform, e.g. a page's
+                "items".
+        """
+        count = len(raw_responses)
+        answer_index = ANSWER_FIELD_INDEX
+        score_index = SCORE_INDEX
+        answers = {name: [None] * count for name in ANSWER_FIELDS}
+        values = np.full((count, len(SCORE_FIELDS)), np.nan)
+        raw_scores = []
+
+        for row, raw_response in enumerate(raw_responses):
+            for answer in raw_response["answers"]:
+                name = answer_index.get(answer["field"]["id"])
+                if name is not None:
+                    answers[name][row] = (
+                        answer.get("text")
+                        if answer["type"] == "text"
+                        else answer.get("email")
+                    )
+
+            raw = [None] * len(SCORE_FIELDS)
+            for variable in raw_response["variables"]:
+                column = score_index.get(variable["key"])
+                if column is not None and variable["number"] is not None:
+                    raw[column] = variable["number"]
+                    values[row, column] = variable["number"]
+            raw_scores.append(tuple(raw))
+
+        self.tokens = [raw_response.get("token") for raw_response in raw_responses]
+        self.submitted_at = [
+            raw_response["submitted_at"] for raw_response in raw_responses
         ]
+        self.answers = answers
+        self.scores = FormResponseScoresBatch.from_matrix(raw_scores, values)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        return FormResponse.from_columns(
+            self.tokens[index],
+            self.submitted_at[index],
+            FormResponseAnswersFields(
+                **{name: column[index] for name, column in self.answers.items()}
+            ),
+            self.scores[index],
+        )
 
-        self.score = kwargs.get("score")
-        self.finalpercentage = kwargs.get("finalpercentage")
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def column(self, name):
+        """
+        Returns:
+            list | numpy.ndarray: An answer field (e.g. "church") or score
+                (e.g. "finalpercentage") across every response.
+        """
+        if name in self.answers:
+            return self.answers[name]
+        return self.scores.column(name)
 
 
 class FormResponse:
-    def map_scores_args(self, raw_scores):
+    @classmethod
+    def from_columns(cls, token, submitted_at, answers, scores):
+        form_response = cls.__new__(cls)
+        form_response.token = token
+        form_response.submitted_at = submitted_at
+        form_response.answers = answers
+        form_response.scores = scores
+        return form_response
+
+    @staticmethod
+    def map_scores_args(raw_scores):
         args_for_scores = dict()
         for score in raw_scores:
             args_for_scores[score["key"]] = score["number"]
         return args_for_scores
 
     def __init__(self, raw_response):
+        self.token = raw_response.get("token")
         self.submitted_at = raw_response["submitted_at"]
 
         # Form response answers
         args_for_answers = dict()
         for answer in raw_response["answers"]:
-            try:
-                field_name = FieldIds(answer["field"]["id"]).name
+            field_name = ANSWER_FIELD_INDEX.get(answer["field"]["id"])
+            if field_name is not None:
                 args_for_answers[field_name] = (
-                    answer["text"] if answer["type"] == "text" else answer["email"]
+                    answer.get("text")
+                    if answer["type"] == "text"
+                    else answer.get("email")
                 )
-            except:
-                continue
         self.answers = FormResponseAnswersFields(**args_for_answers)
 
         # Form response scores
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sqlite_module import sqlite_connection
+
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH", "data/job_queue.sqlite3")
+# Jobs each gunicorn worker processes at once. They mostly wait on the render
+# processes and Gmail, so this can be well above the number of cores.
+JOB_QUEUE_CONCURRENCY = int(os.getenv("JOB_QUEUE_CONCURRENCY", "32"))
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "5"))
+JOB_QUEUE_RETRY_BACKOFF = float(os.getenv("JOB_QUEUE_RETRY_BACKOFF", "30"))
+# A running job whose worker has not finished it within this many seconds is
+# assumed lost (e.g. the container restarted) and is made available again.
+JOB_QUEUE_LEASE_SECONDS = float(os.getenv("JOB_QUEUE_LEASE_SECONDS", "900"))
+JOB_QUEUE_POLL_INTERVAL = float(os.getenv("JOB_QUEUE_POLL_INTERVAL", "5"))
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_DEAD = "dead"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    locked_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_available_at ON jobs (status, available_at);
+"""
+
+
+class JobQueue:
+    """
+    A persistent job queue stored in a SQLite file.
+
+    Several gunicorn workers can share one queue file: jobs are claimed inside
+    an immediate transaction, so each job is handed to exactly one worker.
+    Failed jobs are retried with exponential backoff and moved to the dead
+    letter list once they run out of attempts.
+    """
+
+    def __init__(
+        self,
+        db_path=JOB_QUEUE_DB_PATH,
+        max_attempts=JOB_QUEUE_MAX_ATTEMPTS,
+        retry_backoff=JOB_QUEUE_RETRY_BACKOFF,
+        lease_seconds=JOB_QUEUE_LEASE_SECONDS,
+    ):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+
+        self._local = threading.local()
+        self._loop = None
+        self._wakeup = None
+        self._consumer = None
+        self._stopped = threading.Event()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def enqueue(self, event_id, payload):
+        """
+        Persist a job. Redeliveries of an already queued event are ignored.
+
+        Args:
+            event_id (str): The webhook event id, used to drop duplicates.
+            payload (dict): The job's JSON-serialisable payload.
+
+        Returns:
+            int: The id of the queued job.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR IGNORE INTO jobs"
+            " (event_id, payload, status, available_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (event_id, json.dumps(payload), STATUS_PENDING, now, now, now),
+        )
+        job_id = connection.execute(
+            "SELECT id FROM jobs WHERE event_id = ?", (event_id,)
+        ).fetchone()["id"]
+
+        self._notify()
+        return job_id
+
+    def claim(self):
+        """
+        Take the next due job, or reclaim one whose lease has expired.
+
+        Returns:
+            sqlite3.Row | None: The claimed job, or None if nothing is due.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?"
+                " WHERE status = ? AND locked_at < ?",
+                (STATUS_PENDING, now, STATUS_RUNNING, now - self.lease_seconds),
+            )
+            job = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND available_at <= ?"
+                " ORDER BY available_at LIMIT 1",
+                (STATUS_PENDING, now),
+            ).fetchone()
+            if job is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1,"
+                    " locked_at = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_RUNNING, now, now, job["id"]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return job
+
+    def complete(self, job_id):
+        """
+        Mark a job as successfully processed.
+        """
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, locked_at = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_DONE, time.time(), job_id),
+        )
+
+    def fail(self, job_id, attempts, error):
+        """
+        Schedule a failed job for retry, or dead-letter it.
+
+        Args:
+            job_id (int): The failed job.
+            attempts (int): How many times the job has now been attempted.
+            error (Exception): The error the job failed with.
+        """
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, available_at = STATUS_DEAD, now
+        else:
+            status = STATUS_PENDING
+            available_at = now + self.retry_backoff * 2 ** (attempts - 1)
+
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, available_at = ?, locked_at = NULL,"
+            " last_error = ?, updated_at = ? WHERE id = ?",
+            (status, available_at, repr(error), now, job_id),
+        )
+
+    def list_dead_letters(self):
+        """
+        Returns:
+            list: The jobs that ran out of attempts, newest first.
+        """
+        rows = self._connection().execute(
+            "SELECT id, event_id, attempts, last_error, created_at, updated_at"
+            " FROM jobs WHERE status = ? ORDER BY updated_at DESC",
+            (STATUS_DEAD,),
+        )
+        return [dict(row) for row in rows]
+
+    def retry_dead_letter(self, job_id):
+        """
+        Move a dead-lettered job back onto the queue with fresh attempts.
+
+        Returns:
+            bool: True if the job was dead-lettered and has been requeued.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, attempts = 0, available_at = ?,"
+            " updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_PENDING, now, now, job_id, STATUS_DEAD),
+        )
+        self._notify()
+        return cursor.rowcount > 0
+
+    def start_workers(self, handler, concurrency=JOB_QUEUE_CONCURRENCY):
+        """
+        Feed queued payloads to `handler` on this process's event loop, up
+        to `concurrency` at a time.
+
+        Args:
+            handler (coroutine function): Awaited with each job's payload
+                and its `event_id`. Raising marks the attempt as failed.
+            concurrency (int): The most jobs in progress at once.
+        """
+        from event_loop_module import get_event_loop_thread
+
+        event_loop = get_event_loop_thread()
+        self._loop = event_loop.loop
+        self._consumer = event_loop.submit(self._consume(handler, concurrency))
+
+    def stop_workers(self):
+        self._stopped.set()
+        self._notify()
+
+    def _notify(self):
+        # Called from request threads; the consumer waits on the loop.
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _consume(self, handler, concurrency):
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(concurrency)
+        jobs = set()
+
+        while not self._stopped.is_set():
+            await slots.acquire()
+            # Cleared before claiming, so a job enqueued from here on is
+            # not missed while waiting below.
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.claim)
+            except sqlite3.Error as error:
+                print(f"Failed to claim job: {error}")
+                job = None
+
+            if job is None:
+                slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run_job(handler, job))
+            jobs.add(task)
+            task.add_done_callback(jobs.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _run_job(self, handler, job):
+        attempts = job["attempts"] + 1
+        try:
+            await handler(json.loads(job["payload"]), event_id=job["event_id"])
+            await asyncio.to_thread(self.complete, job["id"])
+        except Exception as error:
+            print(f"Job {job['id']} failed (attempt {attempts}): {error!r}")
+            await asyncio.to_thread(self.fail, job["id"], attempts, error)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns:
+        JobQueue: This process's job queue, with its workers running.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            # Imported here so the queue itself stays cheap to import.
+            from pipeline_module import process_form_response_async
+
+            _job_queue = JobQueue()
+            _job_queue.start_workers(process_form_response_async)
+        return _job_queue
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+from sqlite_module import sqlite_connection
+
+LEDGER_DB_PATH = os.getenv("LEDGER_DB_PATH", "data/ledger.sqlite3")
+# A response claimed this many seconds ago and still not finished is assumed
+# lost (e.g. the container restarted) and may be claimed again.
+LEDGER_LEASE_SECONDS = float(os.getenv("LEDGER_LEASE_SECONDS", "900"))
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    token TEXT PRIMARY KEY,
+    event_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    message_id TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_event_id ON responses (event_id);
+"""
+
+
+class ProcessingLedger:
+    """
+    Which form responses have been rendered and emailed, keyed by the
+    response's Typeform token and kept in SQLite so every gunicorn worker and
+    backlog run shares it.
+
+    A response is claimed before any rendering starts. While one execution
+    holds the claim, duplicates (webhook redeliveries, overlapping backlog
+    runs) are skipped; once it is done they are skipped for good.
+    """
+
+    def __init__(self, db_path=LEDGER_DB_PATH, lease_seconds=LEDGER_LEASE_SECONDS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def claim(self, token, event_id=None):
+        """
+        Claim a response for processing.
+
+        Args:
+            token (str): The response's Typeform token.
+            event_id (str, optional): The webhook event that delivered it.
+
+        Returns:
+            bool: True if the caller should process the response; False if it
+                has already been processed or is being processed elsewhere.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT status, updated_at FROM responses WHERE token = ?", (token,)
+            ).fetchone()
+            if row is None:
+                connection.execute(
+                    "INSERT INTO responses"
+                    " (token, event_id, status, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (token, event_id, STATUS_RUNNING, now, now),
+                )
+                claimed = True
+            elif row["status"] == STATUS_DONE or (
+                row["status"] == STATUS_RUNNING
+                and row["updated_at"] > now - self.lease_seconds
+            ):
+                claimed = False
+            else:
+                connection.execute(
+                    "UPDATE responses SET status = ?, attempts = attempts + 1,"
+                    " event_id = COALESCE(?, event_id), updated_at = ?"
+                    " WHERE token = ?",
+                    (STATUS_RUNNING, event_id, now, token),
+                )
+                claimed = True
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def complete(self, token, message_id=None):
+        """
+        Mark a claimed response as processed, so it is never processed again.
+        """
+        self._connection().execute(
+            "UPDATE responses SET status = ?, message_id = ?, last_error = NULL,"
+            " updated_at = ? WHERE token = ?",
+            (STATUS_DONE, message_id, time.time(), token),
+        )
+
+    def fail(self, token, error):
+        """
+        Release a claimed response that failed, so it can be claimed again.
+        """
+        self._connection().execute(
+            "UPDATE responses SET status = ?, last_error = ?, updated_at = ?"
+            " WHERE token = ?",
+            (STATUS_FAILED, repr(error), time.time(), token),
+        )
+
+    def is_done(self, token):
+        row = (
+            self._connection()
+            .execute("SELECT status FROM responses WHERE token = ?", (token,))
+            .fetchone()
+        )
+        return row is not None and row["status"] == STATUS_DONE
+
+    def get(self, token=None, event_id=None):
+        """
+        Returns:
+            dict | None: The ledger entry for a response token or webhook
+                event id.
+        """
+        if token is not None:
+            query, key = "SELECT * FROM responses WHERE token = ?", token
+        else:
+            query, key = "SELECT * FROM responses WHERE event_id = ?", event_id
+        row = self._connection().execute(query, (key,)).fetchone()
+        return dict(row) if row else None
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """
+    Returns:
+        ProcessingLedger: This process's processing ledger.
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = ProcessingLedger()
+        return _ledger
@@ -0,0 +1,199 @@
+"""
+Replays webhook deliveries against a running server at a target rate.
+
+    python load_test.py --rate 20 --duration 30
+    python load_test.py --rate 20 --duration 30 --gmail-stats http://127.0.0.1:8092/stats
+    python load_test.py --rate 20 --duration 30 --partials 4
+
+Payloads are shaped like example-webhook-response.json, each with its own
+event id, response token and random scores. With --partials, each response
+is preceded by that many form_response_partial deliveries carrying a growing
+share of its answers, as Typeform sends while the form is filled in.
+
+Requests are sent on a fixed schedule whether or not earlier ones have
+finished, and each latency is measured from the request's scheduled time, so
+a server that falls behind shows up in the percentiles rather than slowing
+the generator down.
+
+With --gmail-stats pointing at the Gmail stand-in (stand_in_services.py),
+the run also waits until every accepted report has been emailed and
+reports the end-to-end throughput.
+"""
+
+import argparse
+import queue
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+from benchmark import synthetic_raw_responses
+
+
+def webhook_payloads(count, seed=None, partials=0):
+    """
+    Returns:
+        list: Webhook deliveries with unique event ids and response tokens,
+            `partials` partial deliveries before each submitted response.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    payloads = []
+    for index, raw_response in enumerate(synthetic_raw_responses(count, seed)):
+        raw_response["token"] = f"load-{run_id}-{index}"
+        answers = raw_response["answers"]
+        for partial in range(1, partials + 1):
+            payloads.append(
+                {
+                    "event_id": uuid.uuid4().hex,
+                    "event_type": "form_response_partial",
+                    "form_response": {
+                        "form_id": raw_response.get("form_id"),
+                        "token": raw_response["token"],
+                        "landed_at": raw_response.get("landed_at"),
+                        "answers": answers[: len(answers) * partial // (partials + 1)],
+                    },
+                }
+            )
+        payloads.append(
+            {
+                "event_id": uuid.uuid4().hex,
+                "event_type": "form_response",
+                "form_response": raw_response,
+            }
+        )
+    return payloads
+
+
+def percentiles(samples):
+    """
+    Returns:
+        dict: The 50th, 95th and 99th percentile of the samples.
+    """
+    if len(samples) < 2:
+        return {name: (samples[0] if samples else 0) for name in ["p50", "p95", "p99"]}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def sent_count(stats_url):
+    return requests.get(stats_url, timeout=10).json().get("sent", 0)
+
+
+def run(url, payloads, rate, concurrency):
+    """
+    Send every payload at `rate` a second from `concurrency` threads.
+
+    Returns:
+        list: (status code or error name, latency in seconds) for each request.
+    """
+    schedule = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+    local = threading.local()
+
+    def worker():
+        local.session = requests.Session()
+        while True:
+            item = schedule.get()
+            if item is None:
+                return
+            scheduled_at, payload = item
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                response = local.session.post(url, json=payload, timeout=60)
+                outcome = response.status_code
+            except requests.RequestException as error:
+                outcome = type(error).__name__
+            latency = time.perf_counter() - scheduled_at
+            with results_lock:
+                results.append((outcome, latency))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter() + 0.1
+    for index, payload in enumerate(payloads):
+        schedule.put((start + index / rate, payload))
+    for _ in threads:
+        schedule.put(None)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--rate", type=float, default=10, help="requests/second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--partials", type=int, default=0, help="partial deliveries per response"
+    )
+    parser.add_argument("--gmail-stats", help="the Gmail stand-in's /stats URL")
+    parser.add_argument("--drain-timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    payloads = webhook_payloads(
+        int(args.rate * args.duration / (args.partials + 1)), args.seed, args.partials
+    )
+    sent_before = sent_count(args.gmail_stats) if args.gmail_stats else 0
+
+    started = time.perf_counter()
+    results = run(args.url, payloads, args.rate, args.concurrency)
+    elapsed = time.perf_counter() - started
+
+    if not results:
+        print(f"No requests completed in {elapsed:.1f}s")
+        return 1
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+    # Submitted responses are accepted (202); partial ones recorded (200).
+    accepted = outcomes.get(202, 0)
+    succeeded = accepted + outcomes.get(200, 0)
+
+    print(f"{len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.1f}/s)")
+    print(
+        "Responses:",
+        ", ".join(f"{k}: {v}" for k, v in sorted(outcomes.items(), key=str)),
+    )
+    print(
+        "Webhook latency (ms): "
+        + ", ".join(
+            f"{name} {value * 1000:.1f}"
+            for name, value in percentiles(latencies).items()
+        )
+        + f", max {latencies[-1] * 1000:.1f}"
+    )
+
+    if not args.gmail_stats or not accepted:
+        return 0 if succeeded == len(results) else 1
+
+    # Wait for the background workers to email every accepted report
+    deadline = time.perf_counter() + args.drain_timeout
+    sent = 0
+    while time.perf_counter() < deadline:
+        sent = sent_count(args.gmail_stats) - sent_before
+        if sent >= accepted:
+            break
+        time.sleep(0.5)
+    total = time.perf_counter() - started
+    print(
+        f"{sent}/{accepted} reports emailed in {total:.1f}s "
+        f"({sent / total:.2f} reports/s end to end)"
+    )
+    return 0 if succeeded == len(results) and sent >= accepted else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# When set (gunicorn_config.py sets it), every worker process writes its
+# metrics to files in this directory and /metrics adds them all up.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Report stages take from milliseconds (MIME encoding) to tens of seconds (a
+# cold chart renderer or a slow Typeform page).
+STAGE_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    float("inf"),
+)
+
+STAGE_LATENCY = Histogram(
+    "report_stage_duration_seconds",
+    "Time spent in each stage of the report pipeline.",
+    ["stage"],
+    buckets=STAGE_LATENCY_BUCKETS,
+)
+STAGE_IN_FLIGHT = Gauge(
+    "report_stage_in_flight",
+    "Calls currently running in each stage of the report pipeline.",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+STAGE_FAILURES = Counter(
+    "report_stage_failures_total",
+    "Stage calls that raised an exception.",
+    ["stage"],
+)
+REPORTS_RENDERED = Counter("reports_rendered_total", "Reports rendered.")
+REPORT_SIZE_BYTES = Histogram(
+    "report_size_bytes",
+    "Size of each rendered report PDF.",
+    buckets=(50e3, 100e3, 150e3, 200e3, 300e3, 500e3, 1e6, 2e6, float("inf")),
+)
+EMAILS_SENT = Counter("emails_sent_total", "Report emails accepted by Gmail.")
+EMAIL_FAILURES = Counter("email_failures_total", "Report emails that failed to send.")
+PARTIAL_RESPONSES_RECEIVED = Counter(
+    "partial_responses_received_total",
+    "form_response_partial webhooks received.",
+)
+PARTIAL_RESPONSES_WRITTEN = Counter(
+    "partial_responses_written_total",
+    "Partial responses written to the store, each merging one or more " "deliveries.",
+)
+SEND_QUEUE_DEPTH = Gauge(
+    "gmail_send_queue_depth",
+    "Messages waiting for the send scheduler or being sent to Gmail.",
+    multiprocess_mode="livesum",
+)
+SEND_DRAIN_SECONDS = Gauge(
+    "gmail_send_drain_seconds",
+    "Expected seconds until every queued message has been sent, at the "
+    "scheduler's rate.",
+    multiprocess_mode="livemax",
+)
+SEND_RETRIES = Counter(
+    "gmail_send_retries_total",
+    "Messages retried after a rate limit (429), server error or dropped " "connection.",
+    ["reason"],
+)
+STARTUP_SECONDS = Gauge(
+    "startup_seconds",
+    "Seconds the gunicorn master took to start, or a worker from fork until "
+    "it was ready to serve.",
+    ["role"],
+    multiprocess_mode="liveall",
+)
+STARTUP_MEMORY_BYTES = Gauge(
+    "startup_memory_bytes",
+    "Process memory once started: resident (rss), proportional share of pages "
+    "shared with other processes (pss), and shared with them (shared).",
+    ["role", "kind"],
+    multiprocess_mode="liveall",
+)
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Time a stage of the report pipeline, as a `with` block or a decorator.
+
+    Records the stage's latency, counts it as in flight while it runs and
+    counts it as failed if it raises.
+
+    Args:
+        stage (str): The stage's metric label.
+    """
+    in_flight = STAGE_IN_FLIGHT.labels(stage)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+        in_flight.dec()
+
+
+def memory_usage():
+    """
+    Returns:
+        dict: This process's resident, proportional and shared memory in
+            bytes. Only resident memory is available outside Linux.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            fields = dict(line.split(":", 1) for line in smaps if ":" in line)
+    except OSError:
+        import resource
+
+        # ru_maxrss is the peak, in kilobytes on Linux but bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss": peak * (1 if sys.platform == "darwin" else 1024)}
+
+    def kilobytes(*names):
+        return sum(int(fields.get(name, "0 kB").split()[0]) for name in names) * 1024
+
+    return {
+        "rss": kilobytes("Rss"),
+        "pss": kilobytes("Pss"),
+        "shared": kilobytes("Shared_Clean", "Shared_Dirty"),
+    }
+
+
+def format_memory_usage(usage):
+    return ", ".join(f"{kind} {size / 2**20:.1f} MiB" for kind, size in usage.items())
+
+
+def record_startup(role, seconds):
+    """
+    Record and print how long this process took to start and its memory use.
+
+    Args:
+        role (str): "master" or "worker".
+        seconds (float): How long the process took to become ready.
+    """
+    usage = memory_usage()
+    STARTUP_SECONDS.labels(role).set(seconds)
+    for kind, size in usage.items():
+        STARTUP_MEMORY_BYTES.labels(role, kind).set(size)
+    print(
+        f"{role.capitalize()} {os.getpid()} ready in {seconds:.2f}s "
+        f"({format_memory_usage(usage)})"
+    )
+
+
+def render_metrics():
+    """
+    Returns:
+        tuple: The metrics of every worker process in Prometheus text format,
+            and its content type.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    Drop an exited worker's live gauges (e.g. in-flight counts), keeping its
+    counters and histograms in the totals.
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
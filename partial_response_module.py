@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics_module import PARTIAL_RESPONSES_RECEIVED, PARTIAL_RESPONSES_WRITTEN
+from sqlite_module import sqlite_connection
+
+PARTIAL_RESPONSE_DB_PATH = os.getenv(
+    "PARTIAL_RESPONSE_DB_PATH", "data/partial_responses.sqlite3"
+)
+# Partial deliveries for one response within this many seconds of its first
+# are merged in memory and written once.
+PARTIAL_RESPONSE_DEBOUNCE_SECONDS = float(
+    os.getenv("PARTIAL_RESPONSE_DEBOUNCE_SECONDS", "30")
+)
+# Responses not updated for this long are deleted: partial ones that were
+# abandoned, and submitted ones once no more deliveries are expected for them.
+PARTIAL_RESPONSE_RETENTION_HOURS = float(
+    os.getenv("PARTIAL_RESPONSE_RETENTION_HOURS", "24")
+)
+PRUNE_INTERVAL_SECONDS = 3600
+
+STATUS_PARTIAL = "partial"
+STATUS_SUBMITTED = "submitted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partial_responses (
+    token TEXT PRIMARY KEY,
+    event_id TEXT,
+    form_response TEXT,
+    answered INTEGER NOT NULL DEFAULT 0,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS partial_responses_updated_at
+    ON partial_responses (updated_at);
+"""
+
+
+def merge_partial_responses(older, newer):
+    """
+    Merge two deliveries of the same partial response. The newer one's
+    fields win, and answers are combined by question, with newer answers
+    replacing older ones.
+
+    Returns:
+        dict: The merged form response.
+    """
+    answers = {}
+    for answer in (older.get("answers") or []) + (newer.get("answers") or []):
+        answers[answer.get("field", {}).get("id")] = answer
+    return {**older, **newer, "answers": list(answers.values())}
+
+
+class PartialResponseStore:
+    """
+    Progress of responses that have not been submitted yet, from Typeform's
+    form_response_partial webhooks, kept in SQLite so every gunicorn worker
+    shares it.
+
+    Recording a delivery only merges it into memory. Deliveries for the same
+    token are written once per debounce window, on this process's event
+    loop, so a respondent answering question after question costs one write
+    rather than one per answer.
+    """
+
+    def __init__(
+        self,
+        db_path=PARTIAL_RESPONSE_DB_PATH,
+        debounce_seconds=PARTIAL_RESPONSE_DEBOUNCE_SECONDS,
+        retention_hours=PARTIAL_RESPONSE_RETENTION_HOURS,
+    ):
+        self.db_path = db_path
+        self.debounce_seconds = debounce_seconds
+        self.retention_seconds = retention_hours * 3600
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = False
+        self._prune_at = 0
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        return sqlite_connection(self._local, self.db_path)
+
+    def record(self, event_id, raw_response):
+        """
+        Merge a partial delivery into the response's pending entry. It is
+        written when the debounce window that its first delivery opened
+        closes.
+
+        Args:
+            event_id (str): The webhook event that delivered it.
+            raw_response (dict): The partial response data from Typeform.
+        """
+        token = raw_response["token"]
+        PARTIAL_RESPONSES_RECEIVED.inc()
+        with self._lock:
+            entry = self._pending.get(token)
+            if entry is None:
+                self._pending[token] = {
+                    "event_id": event_id,
+                    "form_response": raw_response,
+                    "deliveries": 1,
+                    "due_at": time.time() + self.debounce_seconds,
+                }
+            else:
+                entry["event_id"] = event_id
+                entry["form_response"] = merge_partial_responses(
+                    entry["form_response"], raw_response
+                )
+                entry["deliveries"] += 1
+
+            if not self._flushing:
+                self._flushing = True
+                from event_loop_module import get_event_loop_thread
+
+                get_event_loop_thread().submit(self._flush_when_due())
+
+    def submitted(self, token):
+        """
+        Mark a response as submitted: its pending partial deliveries are
+        dropped, and any written later by another worker are ignored.
+        """
+        with self._lock:
+            self._pending.pop(token, None)
+
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO partial_responses (token, status, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (token) DO UPDATE SET status = excluded.status,"
+            " updated_at = excluded.updated_at",
+            (token, STATUS_SUBMITTED, now, now),
+        )
+        self._prune_when_due()
+
+    def prune(self):
+        """
+        Delete the responses that have not been updated within the retention
+        period.
+
+        Returns:
+            int: How many responses were deleted.
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM partial_responses WHERE updated_at < ?",
+            (time.time() - self.retention_seconds,),
+        )
+        return cursor.rowcount
+
+    def _prune_when_due(self):
+        now = time.time()
+        with self._lock:
+            if now < self._prune_at:
+                return
+            self._prune_at = now + PRUNE_INTERVAL_SECONDS
+        try:
+            deleted = self.prune()
+        except sqlite3.Error as error:
+            print(f"Failed to prune partial responses: {error}")
+            return
+        if deleted:
+            print(f"Pruned {deleted} partial responses")
+
+    def flush(self, force=False):
+        """
+        Write the pending entries whose debounce window has closed.
+
+        Args:
+            force (bool): Write every pending entry, e.g. on shutdown.
+
+        Returns:
+            int: How many entries were written.
+        """
+        now = time.time()
+        with self._lock:
+            due = {
+                token: entry
+                for token, entry in self._pending.items()
+                if force or entry["due_at"] <= now
+            }
+            for token in due:
+                del self._pending[token]
+
+        done = set()
+        written = 0
+        try:
+            for token, entry in due.items():
+                # Skipped if the response has been submitted meanwhile.
+                written += self._write(token, entry)
+                done.add(token)
+        except sqlite3.Error:
+            # Keep the rest for the next flush, behind any newer deliveries.
+            with self._lock:
+                for token, entry in due.items():
+                    if token in done:
+                        continue
+                    newer = self._pending.get(token)
+                    if newer is not None:
+                        entry["form_response"] = merge_partial_responses(
+                            entry["form_response"], newer["form_response"]
+                        )
+                        entry["event_id"] = newer["event_id"]
+                        entry["deliveries"] += newer["deliveries"]
+                    entry["due_at"] = now + self.debounce_seconds
+                    self._pending[token] = entry
+            raise
+        finally:
+            PARTIAL_RESPONSES_WRITTEN.inc(written)
+        self._prune_when_due()
+        return written
+
+    def _write(self, token, entry):
+        """
+        Returns:
+            bool: True if the entry was written; False if its response has
+                been submitted.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT status, form_response FROM partial_responses"
+                " WHERE token = ?",
+                (token,),
+            ).fetchone()
+            form_response = entry["form_response"]
+            written = True
+            if row is not None and row["status"] == STATUS_SUBMITTED:
+                written = False
+            elif row is None:
+                connection.execute(
+                    "INSERT INTO partial_responses (token, event_id, form_response,"
+                    " answered, deliveries, status, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        token,
+                        entry["event_id"],
+                        json.dumps(form_response),
+                        len(form_response.get("answers") or []),
+                        entry["deliveries"],
+                        STATUS_PARTIAL,
+                        now,
+                        now,
+                    ),
+                )
+            else:
+                # Another worker wrote deliveries for this response too.
+                if row["form_response"]:
+                    form_response = merge_partial_responses(
+                        json.loads(row["form_response"]), form_response
+                    )
+                connection.execute(
+                    "UPDATE partial_responses SET event_id = ?, form_response = ?,"
+                    " answered = ?, deliveries = deliveries + ?, updated_at = ?"
+                    " WHERE token = ?",
+                    (
+                        entry["event_id"],
+                        json.dumps(form_response),
+                        len(form_response.get("answers") or []),
+                        entry["deliveries"],
+                        now,
+                        token,
+                    ),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return written
+
+    async def _flush_when_due(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._flushing = False
+                    return
+                due_at = min(entry["due_at"] for entry in self._pending.values())
+
+            await asyncio.sleep(max(0, due_at - time.time()))
+            try:
+                await asyncio.to_thread(self.flush)
+            except sqlite3.Error as error:
+                print(f"Failed to write partial responses: {error}")
+
+
+_partial_responses = None
+_partial_responses_lock = threading.Lock()
+
+
+def get_partial_responses():
+    """
+    Returns:
+        PartialResponseStore: This process's partial response store.
+    """
+    global _partial_responses
+    with _partial_responses_lock:
+        if _partial_responses is None:
+            _partial_responses = PartialResponseStore()
+        return _partial_responses
+
+
+def flush_partial_responses():
+    """
+    Write every pending partial response, if any were recorded here.
+    """
+    with _partial_responses_lock:
+        partial_responses = _partial_responses
+    if partial_responses is not None:
+        partial_responses.flush(force=True)
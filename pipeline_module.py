@@ -0,0 +1,57 @@
+import asyncio
+
+from church_module import get_church_aggregates
+from email_module import gmail_send_message_async
+from form_response_module import parse_raw_response
+from ledger_module import get_ledger
+from render_pool_module import render_report_async
+
+
+async def process_form_response_async(raw_response, event_id=None):
+    """
+    Parse a raw Typeform response, render its report and email it.
+
+    Runs on the event loop: the report is rendered on the render process
+    pool and emailed with a non-blocking upload, so a worker can have many
+    responses waiting on Gmail while its render processes keep the cores
+    busy. SQLite bookkeeping runs in threads, off the loop.
+
+    Responses that have already been emailed, or are being processed by
+    another worker, are skipped (see ledger_module).
+
+    Args:
+        raw_response (dict): The raw response data from Typeform.
+        event_id (str, optional): The webhook event that delivered it.
+
+    Returns:
+        dict | None: The Gmail message that was sent, or None if skipped.
+
+    Raises:
+        RuntimeError: If the report could not be emailed.
+    """
+    form_response = parse_raw_response(raw_response)
+    await asyncio.to_thread(get_church_aggregates().add, form_response)
+
+    ledger = get_ledger()
+    token = form_response.token
+    if token and not await asyncio.to_thread(ledger.claim, token, event_id):
+        print(f"Skipped response {token}: already processed or in progress")
+        return None
+
+    try:
+        # A retry after a failed send reuses the report rendered the first
+        # time, from the artifact cache.
+        email, report = await render_report_async(form_response)
+
+        sent_message = await gmail_send_message_async(email, report)
+        if sent_message is None:
+            raise RuntimeError(f"Failed to email report to {email}")
+    except Exception as error:
+        if token:
+            await asyncio.to_thread(ledger.fail, token, error)
+        raise
+
+    if token:
+        await asyncio.to_thread(ledger.complete, token, sent_message.get("id"))
+    print(f"Processed report for {email}")
+    return sent_message
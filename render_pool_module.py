@@ -0,0 +1,111 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Processes each gunicorn worker renders reports on. gunicorn_config.py
+# splits the cores between its workers.
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(os.cpu_count() or 1)))
+
+
+def init_render_process():
+    from report_module import (
+        CHART_BACKEND,
+        ChartBackends,
+        preload_report_dependencies,
+    )
+
+    preload_report_dependencies()
+    if CHART_BACKEND != ChartBackends.plotly:
+        return
+
+    from chart_render_module import start_render_pool
+
+    try:
+        start_render_pool()
+    except Exception as error:
+        # Leave it to the first render to start the pool (and report the error).
+        print(f"Failed to warm chart render pool: {error!r}")
+
+
+def new_render_pool(processes=RENDER_PROCESSES):
+    """
+    Returns:
+        ProcessPoolExecutor: A pool of `processes` render processes, each
+            with the report dependencies loaded.
+    """
+    # Forked from a fork server rather than from the server process, which
+    # already runs threads. The fork server imports the report libraries
+    # once, so each render process starts with them loaded.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["report_module"])
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=context,
+        initializer=init_render_process,
+    )
+
+
+def render_report(form_response):
+    """
+    Render one report, or fetch it from the artifact cache. Runs inside a
+    render process.
+
+    Args:
+        form_response (FormResponse | dict): The parsed response, or the raw
+            response data from Typeform.
+
+    Returns:
+        tuple: The respondent's email and the report's PDF bytes.
+    """
+    from artifact_cache_module import get_artifact_cache, report_metadata
+    from form_response_module import parse_raw_response
+    from report_module import generate_report_markdown, report_digest
+
+    if isinstance(form_response, dict):
+        form_response = parse_raw_response(form_response)
+    report = get_artifact_cache().get_or_render(
+        form_response.token,
+        report_digest(form_response),
+        lambda: generate_report_markdown(form_response, in_memory=True),
+        report_metadata(form_response),
+    )
+    return form_response.answers.email, report
+
+
+async def render_report_async(form_response):
+    """
+    Render a report on this process's render pool without blocking the
+    event loop.
+
+    Returns:
+        tuple: The respondent's email and the report's PDF bytes.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_pool(), render_report, form_response)
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    Returns:
+        ProcessPoolExecutor: This process's render pool. Its processes are
+            started on first use.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = new_render_pool()
+        return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(cancel_futures=True)
+            _render_pool = None
@@ -1,27 +1,70 @@
-import math
+import hashlib
+import io
+import json
 import os
 import string
+import threading
 from enum import Enum
 
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import fitz
+from fitz import Archive
 from markdown_pdf import MarkdownPdf, Section
-from pypdf import PdfWriter
+from pypdf import PdfReader, PdfWriter
 
+from chart_cache_module import get_chart_cache
 from content.summary_text import (
     DOMAIN_LEVEL_SUMMARY_INSIGHTS,
     KEY_NEXT_STEP,
     SUBDOMAIN_LEVEL_TEXT_CONTENT,
 )
-from interfaces.form_response import FormResponse
+from fragment_module import get_fragment_library
+from interfaces.form_response import DOMAINS, FormResponse
+from metrics_module import REPORT_SIZE_BYTES, REPORTS_RENDERED, timed_stage
+from template_module import (
+    preload_templates,
+    render_static_template,
+    render_template,
+    templates_digest,
+)
+from vector_chart_module import (
+    draw_radar_chart,
+    draw_table,
+    is_placeholder_image,
+    placeholder_image,
+    remove_placeholder_image,
+)
 
-SUMMARY_PARAGRAPH = "This report provides a snapshot of your church’s missions readiness based on your self-rated responses to the Church Missions Readiness Assessment (CMRA). The overall readiness score is an average across all domains and should be seen as an indicative measure rather than a final verdict. A lower score does not mean that your church is less ready for missions; rather, it highlights areas that may benefit from further growth and reflection.\n\n The suggestions included in this report are offered as guidance to spark ideas and conversations. Each church is unique, and we encourage you to discern how best to contextualize these findings within your own setting. If multiple participants from your church have completed the CMRA, we recommend sharing and comparing your reports, and using the reflection questions at the end of this document to facilitate healthy discussion as a leadership team.\n\n For further dialogue or support in processing these results, feel free to contact Antioch21 - we would be glad to journey with you."
-RADAR_CHART_IMAGE_PATH = "images/radar_chart.png"
-DOMAIN_TABLE_IMAGE_PATH = "images/domain_table.png"
 LOGO_IMAGE_PATH = "images/logo_small.png"
 COVER_PAGE_PATH = "pages/cover_page.pdf"
 END_PAGE_PATH = "pages/end_page.pdf"
+# Names the in-memory chart images are known by inside a report's asset archive.
+RADAR_CHART_IMAGE_NAME = "radar_chart.png"
+DOMAIN_TABLE_IMAGE_NAME = "domain_table.png"
+# Pixel sizes of the chart images, as rendered by plotly.
+RADAR_CHART_SIZE = (700, 500)
+DOMAIN_TABLE_SIZE = (700, 400)
+# Keep the intermediate and final PDFs in memory instead of writing temp files.
+IN_MEMORY_REPORTS = os.getenv("IN_MEMORY_REPORTS", "false").lower() == "true"
+# Assemble the domain breakdown pages from precompiled PDF fragments.
+PRECOMPILED_FRAGMENTS = os.getenv("PRECOMPILED_FRAGMENTS", "true").lower() == "true"
+# Images are downsampled to this resolution at the size they are printed at.
+# 0 keeps them at full size.
+REPORT_IMAGE_DPI = float(os.getenv("REPORT_IMAGE_DPI", "150"))
+# Also write reports with compressed object streams and recompress their
+# images and fonts.
+REPORT_RECOMPRESS = os.getenv("REPORT_RECOMPRESS", "true").lower() == "true"
+SCORE_LABEL = "Score:"
+
+ChartBackends = Enum(
+    "ChartBackends",
+    [
+        # Charts rendered to PNG by plotly in headless Chrome (Kaleido).
+        ("plotly", "plotly"),
+        # Charts drawn straight onto the page as PyMuPDF vector graphics.
+        ("pymupdf", "pymupdf"),
+    ],
+)
+CHART_BACKEND = ChartBackends(os.getenv("CHART_BACKEND", "plotly").lower())
 
 Subdomains = Enum(
     "Subdomains",
@@ -65,6 +108,13 @@ IconPaths = Enum(
     ],
 )
 
+DOMAIN_BREAKDOWNS = [
+    (1, Domains.discipleship.value, ["education", "training"]),
+    (2, Domains.sending.value, ["sending1", "membercare"]),
+    (3, Domains.support.value, ["praying", "giving", "community"]),
+    (4, Domains.structure.value, ["organisation", "policies", "partnerships"]),
+]
+
 DomainColors = Enum(
     "DomainColors",
     [
@@ -75,220 +125,446 @@ DomainColors = Enum(
     ],
 )
 
+DOMAIN_TABLE_HEADER = ["Domain", "Score (%)", "Stage (Avg)", "Summary Insight"]
+DOMAIN_TABLE_COLUMN_WIDTHS = [150, 100, 100, 300]
+DOMAIN_TABLE_ALIGN = ["left", "center", "center", "left"]
+RADAR_CHART_LABELS = ["Discipleship", "Sending", "Support", "Structure"]
 
-def generate_report_markdown(data: FormResponse):
+
+@timed_stage("report")
+def generate_report_markdown(data: FormResponse, in_memory=IN_MEMORY_REPORTS):
     """
     Generate a markdown report from the provided data.
 
     Args:
         data (FormResponse): The data to include in the report.
+        in_memory (bool): Keep the intermediate and final PDFs in memory
+            instead of writing them to disk.
 
     Returns:
-        str: The generated markdown report.
+        str | bytes: The path to the generated report, or the report's PDF
+            bytes when `in_memory` is set.
     """
 
-    pdf = MarkdownPdf(toc_level=2, optimize=True)
-
-    insert_intro_page(pdf, data)
-    insert_executive_summary(pdf, data)
-    insert_domain_overview_table(pdf, data)
+    intermediate_report, breakdown_page_number = lay_out_report(data)
+    report = finish_report(intermediate_report, data, breakdown_page_number)
+    REPORTS_RENDERED.inc()
+    REPORT_SIZE_BYTES.observe(len(report))
+    if in_memory:
+        return report
 
-    insert_domain_breakdown(
-        pdf, data, 1, Domains.discipleship.value, ["education", "training"]
-    )
-    insert_domain_breakdown(
-        pdf, data, 2, Domains.sending.value, ["sending1", "membercare"]
-    )
-    insert_domain_breakdown(
-        pdf, data, 3, Domains.support.value, ["praying", "giving", "community"]
-    )
-    insert_domain_breakdown(
-        pdf,
-        data,
-        4,
-        Domains.structure.value,
-        ["organisation", "policies", "partnerships"],
+    final_report_path = (
+        f"a21_church_missions_readiness_report_{data.answers.church}.pdf"
     )
-    insert_final_page(pdf)
+    with open(final_report_path, "wb") as final_report_file:
+        final_report_file.write(report)
+    return final_report_path
+
+
+# Bump when a change to the report's layout should invalidate cached reports.
+REPORT_FORMAT_VERSION = 1
+_content_digest = None
 
-    intermediate_report_path = (
-        f"church_missions_readiness_report_{data.answers.church}.pdf"
+
+def report_digest(data: FormResponse):
+    """
+    Returns:
+        str: A hash of everything a response's report is rendered from: its
+            answers and scores, the report's text content and templates, and
+            the chart backend. Cached reports with the same digest are identical.
+    """
+    global _content_digest
+    if _content_digest is None:
+        content = [DOMAIN_LEVEL_SUMMARY_INSIGHTS, SUBDOMAIN_LEVEL_TEXT_CONTENT]
+        _content_digest = hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    encoded = json.dumps(
+        [
+            REPORT_FORMAT_VERSION,
+            _content_digest,
+            templates_digest(),
+            CHART_BACKEND.value,
+            data.submitted_at,
+            vars(data.answers),
+            data.scores.raw,
+        ],
+        sort_keys=True,
+        default=str,
     )
-    pdf.save(intermediate_report_path)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:32]
 
-    final_report_path = insert_static_cover_and_end_pages(intermediate_report_path)
 
-    clean_up_generated_images()
+@timed_stage("layout")
+def lay_out_report(data: FormResponse):
+    """
+    Lay out the report's markdown sections with markdown-pdf.
 
-    # clean up intermediate report
-    clean_up_report(intermediate_report_path)
+    Args:
+        data (FormResponse): The data to include in the report.
 
-    return final_report_path
+    Returns:
+        tuple: The laid out report as an io.BytesIO, and how many of its
+            pages precede the domain breakdown.
+    """
+    pdf = MarkdownPdf(toc_level=2, optimize=True)
+    root = build_report_archive()
+
+    insert_intro_page(pdf, data, root)
+    insert_executive_summary(pdf, data, root)
+    insert_domain_overview_table(pdf, data, root)
+
+    # The breakdown pages are stamped in from precompiled fragments after the
+    # markdown sections are saved.
+    breakdown_page_number = pdf.page_num
+    if not PRECOMPILED_FRAGMENTS:
+        for domain_number, domain_name, subdomains in DOMAIN_BREAKDOWNS:
+            insert_domain_breakdown(
+                pdf, data, domain_number, domain_name, subdomains, root
+            )
+    insert_final_page(pdf, root)
 
+    intermediate_report = io.BytesIO()
+    pdf.save(intermediate_report)
+    return intermediate_report, breakdown_page_number
 
-def calculate_stage(score):
-    stage = math.floor((score / 100) * 5)
-    return stage if stage > 0 else 1
 
+def finish_report(intermediate_report, data: FormResponse, breakdown_page_number):
+    """
+    Add everything markdown-pdf does not lay out: vector charts and
+    precompiled breakdown pages if enabled, and the static cover and end
+    pages.
 
-def insert_static_cover_and_end_pages(report_path: str):
-    new_path = f"a21_{report_path}"
-    merger = PdfWriter()
+    Args:
+        intermediate_report (io.BytesIO): The report from `lay_out_report`.
+        data (FormResponse): The data to include in the report.
+        breakdown_page_number (int): How many report pages precede the
+            domain breakdown.
+
+    Returns:
+        bytes: The finished report.
+    """
+    if PRECOMPILED_FRAGMENTS or CHART_BACKEND == ChartBackends.pymupdf:
+        return assemble_report(intermediate_report, data, breakdown_page_number)
+    return insert_static_cover_and_end_pages(intermediate_report)
+
+
+@timed_stage("cover_end_merge")
+def insert_static_cover_and_end_pages(report):
+    """
+    Wrap a report with the static cover and end pages.
 
-    for pdf in [COVER_PAGE_PATH, report_path, END_PAGE_PATH]:
-        merger.append(pdf)
+    Args:
+        report (str | io.BytesIO): The path to the report, or a buffer holding it.
 
-    merger.write(new_path)
+    Returns:
+        str | bytes: The path to the merged report, or its bytes if a buffer
+            was given.
+    """
+    static_assets = get_static_assets()
+    merger = PdfWriter()
+
+    static_pages = static_assets["static_pages"]
+    cover_page_count = static_assets["cover_page_count"]
+    # Appended from the same reader, so the pages share their images.
+    merger.append(static_pages, pages=(0, cover_page_count))
+    merger.append(report)
+    merger.append(static_pages, pages=(cover_page_count, len(static_pages.pages)))
+    if REPORT_RECOMPRESS:
+        merger.compress_identical_objects()
+
+    if isinstance(report, str):
+        new_path = f"a21_{report}"
+        merger.write(new_path)
+        merger.close()
+        return new_path
+
+    merged_report = io.BytesIO()
+    merger.write(merged_report)
     merger.close()
+    return merged_report.getvalue()
 
-    return new_path
 
+def build_report_archive():
+    """
+    Create the asset archive a single report renders from.
 
-def insert_intro_page(pdf, data: FormResponse):
-    church_name = data.answers.church or "Unknown Church"
-    respondent = data.answers.respondent or "Anonymous"
-    submitted_at = data.submitted_at or "Unknown Date"
+    The preloaded logo and icons are mounted under their usual paths, and the
+    report's generated charts are added to the archive as memory items.
+
+    Returns:
+        fitz.Archive: A fresh archive owned by one report.
+    """
+    archive = Archive()
+    archive.add(get_static_assets()["images"])
+    return archive
+
+
+_static_assets = None
+
+
+def preload_static_assets():
+    """
+    Load and parse the static cover/end pages, logo and icons once.
+
+    Call this before gunicorn forks its workers so they share the parsed
+    assets instead of re-reading them for every report.
+
+    Returns:
+        dict: The parsed cover and end pages and an archive of the images.
+    """
+    global _static_assets
+    if _static_assets is None:
+        images = Archive()
+        for image_path in [LOGO_IMAGE_PATH] + [icon.value for icon in IconPaths]:
+            with open(image_path, "rb") as image_file:
+                images.add(image_file.read(), image_path)
+
+        static_pages, cover_page_count = load_static_pages(
+            COVER_PAGE_PATH, END_PAGE_PATH
+        )
+        _static_assets = {
+            "static_pages": PdfReader(io.BytesIO(static_pages)),
+            "static_document": fitz.open("pdf", static_pages),
+            "cover_page_count": cover_page_count,
+            "images": images,
+        }
+    return _static_assets
+
+
+def load_static_pages(cover_page_path, end_page_path):
+    """
+    Read the static cover and end pages into one document, with their images
+    downsampled to the size they are printed at. Every report includes both
+    pages, so shrinking them once here shrinks every attachment.
+
+    Keeping both pages in one document lets them share a single copy of the
+    images they have in common (the logo), which each report then copies
+    once.
+
+    Returns:
+        tuple: The pages' PDF bytes, cover pages first, and how many of the
+            pages belong to the cover.
+    """
+    document = fitz.open()
+    original_size = 0
+    for path in [cover_page_path, end_page_path]:
+        with fitz.open(path) as page_document:
+            document.insert_pdf(page_document)
+        original_size += os.path.getsize(path)
+        if path == cover_page_path:
+            cover_page_count = document.page_count
+
+    downsample_images(document)
+    # garbage=4 merges identical objects in a single pass: the logo's two
+    # copies only match once their soft masks have been merged, so it takes
+    # a second pass to merge the images themselves.
+    optimized = document.tobytes(**report_save_options())
+    optimized = fitz.open("pdf", optimized).tobytes(**report_save_options())
+
+    print(f"Optimised static pages: {original_size} -> {len(optimized)} bytes")
+    return optimized, cover_page_count
+
+
+def report_save_options():
+    """
+    Returns:
+        dict: `fitz.Document.tobytes` options that merge identical objects,
+            so each image and font shared between pages is stored once, and
+            compress what is left.
+    """
+    options = {"garbage": 4, "deflate": True}
+    if REPORT_RECOMPRESS:
+        options.update(deflate_images=True, deflate_fonts=True, use_objstms=1)
+    return options
 
-    cover_page = f"![Logo image]({LOGO_IMAGE_PATH})\n\n"
-    cover_page += f"# Church Missions Readiness Report\n\n<br><br>Prepared for: {church_name}\n\nCompleted by: {respondent}\n\nDate: {submitted_at}\n\nBased on the Antioch21 Church Missions Readiness Assessment (CMRA)\n\n"
 
-    css = "h1 { font-family: Arial, sans-serif; text-align: center; margin-top: 50px; } p { font-family: Arial, sans-serif; text-align: center; }"
+def downsample_images(document, dpi=REPORT_IMAGE_DPI):
+    """
+    Downsample images with more pixels than they need at `dpi` for the
+    largest size they are printed at. Images that would not get any smaller,
+    such as JPEGs that compress better than their downsampled pixels, are
+    left alone.
 
-    pdf.add_section(Section(cover_page), user_css=css)
+    Args:
+        document (fitz.Document): The document to shrink in place.
+        dpi (float): The resolution to keep. 0 leaves every image alone.
 
+    Returns:
+        int: How many images were replaced.
+    """
+    if not dpi:
+        return 0
+
+    printed_sizes = {}
+    for page in document:
+        for image in page.get_images(full=True):
+            xref, smask, width, height, bits = image[:5]
+            # Stencil masks and other 1-bit images are already tiny.
+            if bits < 8:
+                continue
+            for rect in page.get_image_rects(xref):
+                longest = max(rect.width, rect.height)
+                if longest > printed_sizes.get(xref, (0,))[0]:
+                    printed_sizes[xref] = (longest, page, smask, width, height)
+
+    replaced = 0
+    for xref, (longest, page, smask, width, height) in printed_sizes.items():
+        scale = dpi * longest / 72 / max(width, height)
+        if scale >= 1:
+            continue
+
+        pixmap = fitz.Pixmap(document, xref)
+        if pixmap.colorspace is not None and pixmap.colorspace.n not in (1, 3):
+            pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+        if smask:
+            pixmap = fitz.Pixmap(pixmap, fitz.Pixmap(document, smask))
+        pixmap = fitz.Pixmap(
+            pixmap, max(1, round(width * scale)), max(1, round(height * scale)), None
+        )
+        if len(pixmap.tobytes("png")) >= len(document.xref_stream_raw(xref)):
+            continue
+        page.replace_image(xref, pixmap=pixmap)
+        replaced += 1
+    return replaced
 
-def insert_executive_summary(pdf, data: FormResponse):
-    overall_readiness_score = data.scores.finalpercentage or 0
-    top_3 = data.scores.top_3_strongest_subdomains
-    bottom_3 = data.scores.bottom_3_weakest_subdomains
 
-    executive_summary = f"# OVERALL READINESS SCORE: {overall_readiness_score}%\n\n{SUMMARY_PARAGRAPH}\n\n"
+def get_static_assets():
+    return preload_static_assets()
 
-    radar_chart_path = generate_executive_summary_radar_chart(data)
-    executive_summary += f"![Radar Chart]({radar_chart_path})\n\n"
 
-    domain_summary = "# Top 3 Strongest Sub-domains\n\n"
-    domain_summary += "| | | |\n| :---: | :---: | :---: |\n"
-    domain_summary += f"| ![subdomain1]({IconPaths[top_3[0][0]].value}) | ![subdomain2]({IconPaths[top_3[1][0]].value}) | ![subdomain3]({IconPaths[top_3[2][0]].value}) |\n"
-    domain_summary += f"| {Subdomains[top_3[0][0]].value} | {Subdomains[top_3[1][0]].value} | {Subdomains[top_3[2][0]].value} |\n"
-    domain_summary += f"| Stage {calculate_stage(top_3[0][1])} | Stage {calculate_stage(top_3[1][1])} | Stage {calculate_stage(top_3[2][1])} |\n\n"
+def insert_intro_page(pdf, data: FormResponse, root="."):
+    cover_page = render_template(
+        "intro_page.md",
+        logo_path=LOGO_IMAGE_PATH,
+        church_name=data.answers.church or "Unknown Church",
+        respondent=data.answers.respondent or "Anonymous",
+        submitted_at=data.submitted_at or "Unknown Date",
+    )
+    css = render_static_template("intro_page.css")
+
+    pdf.add_section(Section(cover_page, root=root), user_css=css)
+
+
+def insert_executive_summary(pdf, data: FormResponse, root):
+    executive_summary = render_template(
+        "executive_summary.md",
+        overall_readiness_score=data.scores.finalpercentage or 0,
+        summary_paragraph=render_static_template("summary_paragraph.md"),
+        radar_chart_path=generate_executive_summary_radar_chart(data, root),
+    )
+    domain_summary = render_template(
+        "subdomain_highlights.md",
+        strongest=subdomain_highlights(data, data.scores.top_3_strongest_subdomains),
+        growth_areas=subdomain_highlights(
+            data, data.scores.bottom_3_weakest_subdomains
+        ),
+    )
+    css = render_static_template("executive_summary.css")
 
-    domain_summary += "# 3 Areas for Growth\n\n"
-    domain_summary += "| | | |\n| :---: | :---: | :---: |\n"
-    domain_summary += f"| ![subdomain1]({IconPaths[bottom_3[0][0]].value}) | ![subdomain2]({IconPaths[bottom_3[1][0]].value}) | ![subdomain3]({IconPaths[bottom_3[2][0]].value}) |\n"
-    domain_summary += f"| {Subdomains[bottom_3[0][0]].value} | {Subdomains[bottom_3[1][0]].value} | {Subdomains[bottom_3[2][0]].value} |\n"
-    domain_summary += f"| Stage {calculate_stage(bottom_3[0][1])} | Stage {calculate_stage(bottom_3[1][1])} | Stage {calculate_stage(bottom_3[2][1])} |\n"
+    pdf.add_section(Section(executive_summary, root=root), user_css=css)
+    pdf.add_section(Section(domain_summary, root=root), user_css=css)
 
-    css = "h1 { font-family: Arial, sans-serif; text-align: center; margin-top: 50px; color: #AD0B0B; } table { margin-left: 55px } td { font-family: Arial, sans-serif; padding-left: 30px; padding-right: 30px; text-align: center; } h3 { text-align: center; font-family: Arial, sans-serif; margin-top: 30px} h2, p { font-family: Arial, sans-serif; }"
 
-    pdf.add_section(Section(executive_summary), user_css=css)
-    pdf.add_section(Section(domain_summary), user_css=css)
+def subdomain_highlights(data: FormResponse, subdomain_scores):
+    """
+    Returns:
+        list: The icon, name and stage of each of the given sub-domains.
+    """
+    return [
+        {
+            "icon": IconPaths[subdomain].value,
+            "name": Subdomains[subdomain].value,
+            "stage": data.scores.subdomain_stage(subdomain),
+        }
+        for subdomain, _ in subdomain_scores
+    ]
 
 
-def insert_domain_overview_table(pdf, data: FormResponse):
+def insert_domain_overview_table(pdf, data: FormResponse, root):
     """
     Insert a table summarizing the scores for each domain.
 
     Args:
         pdf (MarkdownPdf): The PDF object to add the table to.
         data (FormResponse): The data containing scores for each domain.
+        root (fitz.Archive): The report's asset archive.
     """
-    css = "table, th, td { border: 1px solid black; font-family: Arial, sans-serif; } h1 { font-family: Arial, sans-serif; text-align: center; }"
-
-    table = f"![domain table]({generate_styled_table(data)})"
+    overview = render_template(
+        "domain_overview.md", domain_table_path=generate_styled_table(data, root)
+    )
+    css = render_static_template("domain_overview.css")
 
-    pdf.add_section(Section("# DOMAIN OVERVIEW\n\n" + table), user_css=css)
+    pdf.add_section(Section(overview, root=root), user_css=css)
 
 
-def generate_styled_table(data: FormResponse):
-    colors = [
+def domain_table_values(data: FormResponse):
+    """
+    Returns:
+        list: The domain overview table's cell values, column by column.
+    """
+    percentages = data.scores.domain_percentages.tolist()
+    stages = data.scores.domain_stages.tolist()
+    return [
+        [Domains[domain].value for domain in DOMAINS],  # 1st column
+        [f"{round(percentage, 2)}%" for percentage in percentages],  # 2nd column
+        stages,  # 3rd column
         [
-            DomainColors[domain].value
-            for domain in [
-                "discipleship",
-                "sending",
-                "support",
-                "structure",
-            ]
-        ]
-        * 4
+            DOMAIN_LEVEL_SUMMARY_INSIGHTS[domain][stage]
+            for domain, stage in zip(DOMAINS, stages)
+        ],  # 4th column
     ]
 
-    fig = go.Figure(
-        data=[
-            go.Table(
-                columnwidth=[150, 100, 100, 300],
-                header=dict(
-                    values=["Domain", "Score (%)", "Stage (Avg)", "Summary Insight"],
-                    fill_color="lightskyblue",
-                    align="center",
-                    font_size=20,
-                    line=dict(color="#fff", width=12),
-                ),
-                cells=dict(
-                    values=[
-                        [
-                            Domains[domain].value
-                            for domain in [
-                                "discipleship",
-                                "sending",
-                                "support",
-                                "structure",
-                            ]
-                        ],  # 1st column
-                        [
-                            f"{round((getattr(data.scores, domain) / 25) * 100, 2)}%"
-                            for domain in [
-                                "discipleship",
-                                "sending",
-                                "support",
-                                "structure",
-                            ]
-                        ],  # 2nd column
-                        [
-                            calculate_stage((getattr(data.scores, domain) / 25) * 100)
-                            for domain in [
-                                "discipleship",
-                                "sending",
-                                "support",
-                                "structure",
-                            ]
-                        ],  # 3rd column
-                        [
-                            DOMAIN_LEVEL_SUMMARY_INSIGHTS[domain][
-                                calculate_stage(
-                                    (getattr(data.scores, domain) / 25) * 100
-                                )
-                            ]
-                            for domain in [
-                                "discipleship",
-                                "sending",
-                                "support",
-                                "structure",
-                            ]
-                        ],  # 4th column
-                    ],
-                    # line_color="darkslategray",
-                    fill_color=colors,
-                    line=dict(color="#fff", width=12),
-                    align=["left", "center", "center", "left"],
-                    font_size=18,
-                ),
-            )
-        ]
-    )
 
-    # Set the figure to fill the page width and adjust height
-    fig.update_layout(
-        height=400,  # Adjust height as needed
-        margin=dict(l=0, r=0, t=0, b=0),  # Remove margins to maximize space usage
-    )
-    fig.write_image(DOMAIN_TABLE_IMAGE_PATH)
-    return DOMAIN_TABLE_IMAGE_PATH
+@timed_stage("domain_table")
+def generate_styled_table(data: FormResponse, archive):
+    cell_values = domain_table_values(data)
+    if CHART_BACKEND == ChartBackends.pymupdf:
+        return save_chart_placeholder(
+            DOMAIN_TABLE_IMAGE_NAME, DOMAIN_TABLE_SIZE, archive
+        )
+
+    def build_figure():
+        import plotly.graph_objects as go
+
+        colors = [[DomainColors[domain].value for domain in DOMAINS] * 4]
+
+        fig = go.Figure(
+            data=[
+                go.Table(
+                    columnwidth=DOMAIN_TABLE_COLUMN_WIDTHS,
+                    header=dict(
+                        values=DOMAIN_TABLE_HEADER,
+                        fill_color="lightskyblue",
+                        align="center",
+                        font_size=20,
+                        line=dict(color="#fff", width=12),
+                    ),
+                    cells=dict(
+                        values=cell_values,
+                        # line_color="darkslategray",
+                        fill_color=colors,
+                        line=dict(color="#fff", width=12),
+                        align=DOMAIN_TABLE_ALIGN,
+                        font_size=18,
+                    ),
+                )
+            ]
+        )
+
+        # Set the figure to fill the page width and adjust height
+        fig.update_layout(
+            height=DOMAIN_TABLE_SIZE[1],  # Adjust height as needed
+            margin=dict(l=0, r=0, t=0, b=0),  # Remove margins to maximize space usage
+        )
+        return fig
+
+    return save_chart_image(build_figure, cell_values, DOMAIN_TABLE_IMAGE_NAME, archive)
 
 
 def insert_domain_breakdown(
-    pdf, data: FormResponse, domain_number, domain_name, subdomains
+    pdf, data: FormResponse, domain_number, domain_name, subdomains, root="."
 ):
     """
     Insert a breakdown of scores for each sub-domain within each domain.
@@ -296,101 +572,370 @@ def insert_domain_breakdown(
     Args:
         pdf (MarkdownPdf): The PDF object to add the breakdown to.
         data (FormResponse): The data containing scores for each sub-domain.
+        root (str | fitz.Archive): Where the section's images are resolved from.
+    """
+    content = render_template(
+        "domain_breakdown.md",
+        domain_number=domain_number,
+        domain_name=domain_name,
+        subdomains=[
+            subdomain_breakdown_values(
+                subdomain_index,
+                subdomain,
+                data.scores.subdomain_stage(subdomain),
+                getattr(data.scores, subdomain),
+            )
+            for subdomain_index, subdomain in enumerate(subdomains)
+        ],
+        score_label=SCORE_LABEL,
+    )
+
+    css = render_static_template("domain_breakdown.css")
+
+    pdf.add_section(Section(content, root=root), user_css=css)
+
+
+def subdomain_breakdown_values(
+    subdomain_index, subdomain, subdomain_stage, subdomain_score=None
+):
+    """
+    Returns:
+        dict: What subdomain_breakdown.md shows for one sub-domain. Without a
+            score, the score line is left blank for a precompiled fragment.
+    """
+    return {
+        "letter": string.ascii_uppercase[subdomain_index],
+        "name": Subdomains[subdomain].value,
+        "score": subdomain_score,
+        "stage": subdomain_stage,
+        "next_step": SUBDOMAIN_LEVEL_TEXT_CONTENT[subdomain][subdomain_stage][
+            KEY_NEXT_STEP
+        ],
+    }
+
+
+_domain_breakdown_fragments = (None, None)
+_domain_breakdown_fragments_lock = threading.Lock()
+
+
+def get_domain_breakdown_fragments():
+    """
+    Return the precompiled domain breakdown fragments: one per domain title,
+    one per (sub-domain, stage) and the closing rule.
+
+    Returns:
+        FragmentLibrary: The compiled fragments.
+    """
+    global _domain_breakdown_fragments
+    digest = templates_digest()
+    with _domain_breakdown_fragments_lock:
+        if _domain_breakdown_fragments[0] == digest:
+            return _domain_breakdown_fragments[1]
+
+        fragments = {"rule:": render_static_template("domain_breakdown_rule.md")}
+        for domain_number, domain_name, subdomains in DOMAIN_BREAKDOWNS:
+            fragments[f"title:{domain_number}"] = render_static_template(
+                "domain_breakdown_title.md",
+                domain_number=domain_number,
+                domain_name=domain_name,
+            )
+            for subdomain_index, subdomain in enumerate(subdomains):
+                for stage in SUBDOMAIN_LEVEL_TEXT_CONTENT[subdomain]:
+                    fragments[f"subdomain:{subdomain}:{stage}"] = render_template(
+                        "subdomain_breakdown.md",
+                        domain_number=domain_number,
+                        subdomain=subdomain_breakdown_values(
+                            subdomain_index, subdomain, stage
+                        ),
+                        score_label=SCORE_LABEL,
+                    )
+
+        reference = [
+            "title:1",
+            "subdomain:education:1",
+            "subdomain:training:1",
+            "rule:",
+        ]
+        library = get_fragment_library(
+            fragments,
+            reference,
+            render_static_template("domain_breakdown.css"),
+            anchor_labels=[SCORE_LABEL],
+        )
+        _domain_breakdown_fragments = (digest, library)
+        return library
+
+
+def preload_report_dependencies():
     """
-    title = f"## Domain {domain_number}: {domain_name}\n\n"
-    content = ""
-    for subdomain_index, subdomain in enumerate(subdomains):
-        subdomain_name = Subdomains[subdomain].value
-        subdomain_score = getattr(data.scores, subdomain)
-        subdomain_stage = calculate_stage(subdomain_score)
-        content += f"### {domain_number}{string.ascii_uppercase[subdomain_index]}. {subdomain_name}\n\n"
-        content += f"Score: {subdomain_score}%\n\n"
-        content += f"Stage: {subdomain_stage}\n\n"
-        content += f"Next Step: \n * {SUBDOMAIN_LEVEL_TEXT_CONTENT[subdomain][subdomain_stage][KEY_NEXT_STEP]}\n\n"
-    content += "---\n\n"
+    Load everything report rendering reads but never modifies: the static
+    pages and images, the compiled fragments, the chart backend's libraries
+    and the fonts markdown-pdf lays text out with.
+
+    Called as each render process starts (see render_pool_module).
+    """
+    preload_templates()
+    preload_static_assets()
+    preload_report_fragments()
+
+    if CHART_BACKEND == ChartBackends.plotly:
+        import pandas
+        import plotly.express
+        import plotly.graph_objects
+
+        import chart_render_module
+
+    # Laying out one line of text loads MuPDF's fonts.
+    pdf = MarkdownPdf(toc_level=0)
+    pdf.add_section(
+        Section("Antioch21", toc=False),
+        user_css=render_static_template("domain_breakdown.css"),
+    )
+    pdf.save(io.BytesIO())
+
+
+def preload_report_fragments():
+    """
+    Compile or load the domain breakdown fragments ahead of the first report,
+    if precompiled fragments are enabled.
+    """
+    if PRECOMPILED_FRAGMENTS:
+        get_domain_breakdown_fragments()
+
 
-    css = "h1, h2, h3, p, ul { font-family: Arial, sans-serif; }"
+@timed_stage("assemble")
+def assemble_report(report, data: FormResponse, page_number):
+    """
+    Finish a report in a single PyMuPDF document: draw its vector charts,
+    stamp in the domain breakdown pages from precompiled fragments, then add
+    the static cover and end pages.
 
-    pdf.add_section(Section(title + content), user_css=css)
+    Args:
+        report (io.BytesIO): The report as laid out by markdown-pdf.
+        data (FormResponse): The data containing scores for each sub-domain.
+        page_number (int): How many report pages precede the breakdown.
 
+    Returns:
+        bytes: The finished report.
+    """
+    static_assets = get_static_assets()
+    document = fitz.open("pdf", report.getvalue())
+    if CHART_BACKEND == ChartBackends.pymupdf:
+        draw_vector_charts(document, data)
+    if PRECOMPILED_FRAGMENTS:
+        insert_precompiled_domain_breakdowns(document, data, page_number)
+    # Inserted in one go so the pages share their images (PyMuPDF copies
+    # them again on every insert_pdf call), then the cover is moved first.
+    with timed_stage("cover_end_merge"):
+        report_page_count = document.page_count
+        document.insert_pdf(static_assets["static_document"])
+        for index in range(static_assets["cover_page_count"]):
+            document.move_page(report_page_count + index, index)
+    return document.tobytes(**report_save_options())
+
+
+@timed_stage("breakdown_fragments")
+def insert_precompiled_domain_breakdowns(document, data: FormResponse, page_number):
+    """
+    Insert the domain breakdown pages, built from precompiled fragments with
+    only the respondent's scores written in.
 
-def insert_final_page(pdf):
+    Args:
+        document (fitz.Document): The report without its breakdown pages.
+        data (FormResponse): The data containing scores for each sub-domain.
+        page_number (int): How many report pages precede the breakdown.
+    """
+    library = get_domain_breakdown_fragments()
+    page_rect = fitz.paper_rect("A4")
+
+    for offset, (domain_number, domain_name, subdomains) in enumerate(
+        DOMAIN_BREAKDOWNS
+    ):
+        page = document.new_page(
+            page_number + offset, width=page_rect.width, height=page_rect.height
+        )
+        keys = [f"title:{domain_number}"]
+        keys += [
+            f"subdomain:{subdomain}:{data.scores.subdomain_stage(subdomain)}"
+            for subdomain in subdomains
+        ]
+        keys += ["rule:"]
+
+        top = library.top
+        subdomain_scores = [None] + [getattr(data.scores, s) for s in subdomains]
+        for key_index, key in enumerate(keys):
+            placed, anchors = library.place(page, key, top)
+            if SCORE_LABEL in anchors:
+                x, baseline, font_size = anchors[SCORE_LABEL]
+                page.insert_text(
+                    (x + fitz.get_text_length(" ", "helv", font_size), baseline),
+                    f"{subdomain_scores[key_index]}%",
+                    fontname="helv",
+                    fontsize=font_size,
+                )
+            if key_index + 1 < len(keys):
+                top = placed.y1 + library.gap(key, keys[key_index + 1])
+
+    # Existing bookmarks follow their pages; add the breakdown titles back in.
+    toc = document.get_toc(simple=False)
+    for offset, (domain_number, domain_name, _) in enumerate(DOMAIN_BREAKDOWNS):
+        destination = {"kind": fitz.LINK_GOTO, "to": fitz.Point(0, library.top)}
+        title = f"Domain {domain_number}: {domain_name}"
+        toc.append([2, title, page_number + offset + 1, destination])
+    toc.sort(key=lambda entry: entry[2])
+    document.set_toc(toc)
+
+
+def insert_final_page(pdf, root="."):
     """
     Insert a section for reflections and notes.
 
     Args:
         pdf (MarkdownPdf): The PDF object to add the reflections and notes to.
+        root (str | fitz.Archive): Where the section's images are resolved from.
     """
-    reflections_section = "## Reflections and Notes\n\n"
-    reflections_section += "*Feel free  to complete the following prompts and discuss them with your church leadership team.*\n\n<br>"
-    reflections_section += (
-        "1. What is one area you can improve in the next 3 months? \n\n<br><br><br>"
-    )
-    reflections_section += "2. Who in your church leadership team can you share this report with? \n\n<br><br><br>"
-    reflections_section += (
-        "3. What kind of external support would help you grow? \n\n<br><br><br>"
-    )
-    reflections_section += "<hr>\n\n"
+    reflections_section = render_static_template("final_page.md")
+    css = render_static_template("final_page.css")
 
-    reflections_section += "**Contact Antioch21 if you’d like help processing your results**\n\n Email: [darrellong@antioch21.sg](mailto:darrellong@antioch21.sg)\n\nWebsite: [antioch21.sg](https://antioch21.sg)\n\n"
+    pdf.add_section(Section(reflections_section, root=root), user_css=css)
 
-    css = "h1, h2, p { font-family: Arial, sans-serif; }"
 
-    pdf.add_section(Section(reflections_section), user_css=css)
+def radar_chart_values(data: FormResponse):
+    """
+    Returns:
+        list: Each domain's score as a percentage, in radar chart order.
+    """
+    return data.scores.domain_percentages.tolist()
 
 
-def generate_executive_summary_radar_chart(data: FormResponse):
+@timed_stage("radar_chart")
+def generate_executive_summary_radar_chart(data: FormResponse, archive):
     """
     Generate a radar chart for the executive summary.
 
     Args:
         data (FormResponse): The data to include in the radar chart.
+        archive (fitz.Archive): The report's asset archive.
 
     Returns:
-        str: The path to the generated radar chart image.
+        str: The archive name of the generated radar chart image.
     """
-    values = [
-        (data.scores.discipleship / 25) * 100,
-        (data.scores.sending / 25) * 100,
-        (data.scores.support / 25) * 100,
-        (data.scores.structure / 25) * 100,
-    ]
+    values = radar_chart_values(data)
+    if CHART_BACKEND == ChartBackends.pymupdf:
+        return save_chart_placeholder(RADAR_CHART_IMAGE_NAME, RADAR_CHART_SIZE, archive)
 
-    df = pd.DataFrame(
-        dict(
-            r=values,
-            theta=[
-                "Discipleship",
-                "Sending",
-                "Support",
-                "Structure",
-            ],
-        )
+    def build_figure():
+        import pandas as pd
+        import plotly.express as px
+
+        df = pd.DataFrame(dict(r=values, theta=RADAR_CHART_LABELS))
+        fig = px.line_polar(df, r="r", theta="theta", line_close=True)
+        fig.update_traces(fill="toself")
+        return fig
+
+    return save_chart_image(build_figure, values, RADAR_CHART_IMAGE_NAME, archive)
+
+
+def save_chart_image(build_figure, chart_inputs, image_name, archive):
+    """
+    Render a chart into a report's in-memory asset archive.
+
+    Charts are looked up in the chart cache by their inputs first, so plotly
+    and Kaleido only run for combinations that have not been rendered yet.
+
+    Args:
+        build_figure (callable): Builds the plotly figure on a cache miss.
+        chart_inputs (list): Everything the chart's image depends on.
+        image_name (str): The name to give the image inside the archive.
+        archive (fitz.Archive): The report's asset archive.
+
+    Returns:
+        str: The name to reference the image by.
+    """
+    # Imported here so the pymupdf chart backend never starts Kaleido.
+    from chart_render_module import render_figure
+
+    image = get_chart_cache().get_or_render(
+        image_name, chart_inputs, lambda: render_figure(build_figure())
     )
-    fig = px.line_polar(df, r="r", theta="theta", line_close=True)
-    fig.update_traces(fill="toself")
-    fig.write_image(RADAR_CHART_IMAGE_PATH)
+    archive.add(image, image_name)
+    return image_name
+
+
+def save_chart_placeholder(image_name, size, archive):
+    """
+    Hold a chart's place in a report's asset archive with a blank white
+    image (see `placeholder_image`), for `draw_vector_charts` to draw the
+    chart over once the report is laid out.
 
-    # This function should create a radar chart based on the scores in `data`
-    # and return the path to the saved image.
-    return RADAR_CHART_IMAGE_PATH
+    Args:
+        image_name (str): The name to give the image inside the archive.
+        size (tuple): The pixel size of the chart's image.
+        archive (fitz.Archive): The report's asset archive.
+
+    Returns:
+        str: The name to reference the image by.
+    """
+    archive.add(placeholder_image(size), image_name)
+    return image_name
 
 
-def clean_up_generated_images():
+@timed_stage("vector_charts")
+def draw_vector_charts(document, data: FormResponse):
     """
-    Clean up the radar chart image after use.
+    Draw the radar chart and domain overview table as vector graphics over
+    their placeholder images, then empty the placeholders. A placeholder is
+    recognised by its size and its all-white pixels, not by size alone.
+
+    Args:
+        document (fitz.Document): The report as laid out by markdown-pdf.
+        data (FormResponse): The data to chart.
     """
-    if os.path.exists(RADAR_CHART_IMAGE_PATH):
-        os.remove(RADAR_CHART_IMAGE_PATH)
-    if os.path.exists(DOMAIN_TABLE_IMAGE_PATH):
-        os.remove(DOMAIN_TABLE_IMAGE_PATH)
+
+    def radar_chart(page, rect):
+        draw_radar_chart(
+            page,
+            rect,
+            radar_chart_values(data),
+            RADAR_CHART_LABELS,
+            canvas_size=RADAR_CHART_SIZE,
+        )
+
+    def domain_table(page, rect):
+        draw_table(
+            page,
+            rect,
+            DOMAIN_TABLE_HEADER,
+            domain_table_values(data),
+            DOMAIN_TABLE_COLUMN_WIDTHS,
+            header_color="#87CEFA",  # lightskyblue
+            row_colors=[DomainColors[domain].value for domain in DOMAINS],
+            align=DOMAIN_TABLE_ALIGN,
+            canvas_width=DOMAIN_TABLE_SIZE[0],
+        )
+
+    charts = {RADAR_CHART_SIZE: radar_chart, DOMAIN_TABLE_SIZE: domain_table}
+    for page in document:
+        for image in page.get_images(full=True):
+            xref, _, width, height = image[:4]
+            draw_chart = charts.get((width, height))
+            if draw_chart is None or not is_placeholder_image(
+                document, xref, (width, height)
+            ):
+                continue
+            rect = page.get_image_bbox(image)
+            if rect.is_empty:
+                continue
+            draw_chart(page, rect)
+            remove_placeholder_image(document, xref)
 
 
 def clean_up_report(report_path):
     """
-    Clean up the generated report file after use.
+    Clean up the generated report file after use. In-memory reports have
+    nothing to clean up.
     """
-    if os.path.exists(report_path):
+    if isinstance(report_path, str) and os.path.exists(report_path):
         os.remove(report_path)
 
 
@@ -0,0 +1,321 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from metrics_module import SEND_DRAIN_SECONDS, SEND_QUEUE_DEPTH, SEND_RETRIES
+
+# messages.send costs 100 of Gmail's 15,000 quota units per user per minute,
+# i.e. 2.5 messages a second. The rate is per process; gunicorn_config.py
+# splits it between the workers.
+GMAIL_SEND_RATE = float(os.getenv("GMAIL_SEND_RATE", "2.5"))
+GMAIL_SEND_BURST = float(os.getenv("GMAIL_SEND_BURST", "10"))
+GMAIL_SEND_CONCURRENCY = int(os.getenv("GMAIL_SEND_CONCURRENCY", "4"))
+GMAIL_SEND_MAX_ATTEMPTS = int(os.getenv("GMAIL_SEND_MAX_ATTEMPTS", "6"))
+GMAIL_SEND_RETRY_BACKOFF = float(os.getenv("GMAIL_SEND_RETRY_BACKOFF", "1"))
+GMAIL_SEND_MAX_BACKOFF = float(os.getenv("GMAIL_SEND_MAX_BACKOFF", "60"))
+
+
+def error_status(error):
+    """
+    Returns:
+        int | None: The HTTP status of a googleapiclient HttpError.
+    """
+    response = getattr(error, "resp", None)
+    return getattr(response, "status", None)
+
+
+def is_retryable(error):
+    """
+    Returns:
+        bool: True for rate limiting (429), server errors (5xx) and dropped
+            connections, which are worth retrying.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def retry_after(error):
+    """
+    Returns:
+        float | None: The seconds Gmail asked to wait, from Retry-After.
+    """
+    response = getattr(error, "resp", None)
+    try:
+        return float(response.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Allows `rate` units a second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def _take(self, cost):
+        # Take `cost` units if they are available, otherwise return how long
+        # until they will be.
+        with self._lock:
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0
+            return (cost - self.tokens) / self.rate
+
+    def _chunks(self, cost):
+        # A cost larger than the capacity is paid a bucketful at a time, so
+        # it still waits for every unit it takes.
+        while True:
+            chunk = min(cost, self.capacity)
+            yield chunk
+            cost -= chunk
+            if cost <= 0:
+                return
+
+    def acquire(self, cost=1):
+        """
+        Wait until `cost` units are available and take them. Costs larger
+        than the capacity are paid a bucketful at a time.
+        """
+        for chunk in self._chunks(cost):
+            wait = self._take(chunk)
+            while wait:
+                time.sleep(wait)
+                wait = self._take(chunk)
+
+    async def acquire_async(self, cost=1):
+        """
+        Like `acquire`, but waits without blocking the event loop.
+        """
+        for chunk in self._chunks(cost):
+            wait = self._take(chunk)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._take(chunk)
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+class SendScheduler:
+    """
+    Sits between report generation and Gmail: limits the send rate with a
+    token bucket, caps how many sends run at once, and retries rate limited
+    (429) and failed (5xx) sends with exponential backoff and full jitter.
+
+    Callers block until their send has gone out or run out of attempts.
+    """
+
+    def __init__(
+        self,
+        rate=GMAIL_SEND_RATE,
+        burst=GMAIL_SEND_BURST,
+        concurrency=GMAIL_SEND_CONCURRENCY,
+        max_attempts=GMAIL_SEND_MAX_ATTEMPTS,
+        retry_backoff=GMAIL_SEND_RETRY_BACKOFF,
+        max_backoff=GMAIL_SEND_MAX_BACKOFF,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._async_slots = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._retrying = 0
+
+    def backoff(self, attempt, error=None):
+        """
+        Returns:
+            float: Seconds to wait before retry `attempt` (1 for the first).
+        """
+        ceiling = min(self.max_backoff, self.retry_backoff * 2 ** (attempt - 1))
+        delay = random.uniform(0, ceiling)
+        requested = retry_after(error)
+        return max(delay, requested) if requested is not None else delay
+
+    def send(self, call, count=1):
+        """
+        Run a send through the scheduler, retrying it if it is retryable.
+
+        Args:
+            call (callable): Sends `count` messages, e.g. an API request's
+                `execute`, and returns its result.
+            count (int): How many messages the call sends, for rate limiting.
+
+        Returns:
+            The call's result.
+
+        Raises:
+            Exception: The call's last error once it is not retryable or has
+                run out of attempts.
+        """
+        attempt = 1
+        while True:
+            self._track(queued=count)
+            self.bucket.acquire(count)
+            with self._slots:
+                self._track(queued=-count, in_flight=count)
+                try:
+                    return call()
+                except Exception as error:
+                    if attempt >= self.max_attempts or not is_retryable(error):
+                        raise
+                    last_error = error
+                finally:
+                    self._track(in_flight=-count)
+
+            self.wait_to_retry(attempt, last_error, count)
+            attempt += 1
+
+    async def send_async(self, call, count=1):
+        """
+        Like `send`, for a coroutine function `call`, waiting without
+        blocking the event loop. Shares the rate limit with `send`; at most
+        `concurrency` of these calls run at once.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.concurrency)
+
+        attempt = 1
+        while True:
+            self._track(queued=count)
+            await self.bucket.acquire_async(count)
+            async with self._async_slots:
+                self._track(queued=-count, in_flight=count)
+                try:
+                    return await call()
+                except Exception as error:
+                    if attempt >= self.max_attempts or not is_retryable(error):
+                        raise
+                    last_error = error
+                finally:
+                    self._track(in_flight=-count)
+
+            await self.wait_to_retry_async(attempt, last_error, count)
+            attempt += 1
+
+    def wait_to_retry(self, attempt, error, count=1):
+        """
+        Back off before retry `attempt` of `count` messages that failed with
+        `error`, counting them as queued while waiting.
+        """
+        delay = self._retry_delay(attempt, error, count)
+        self._track(queued=count, retrying=count)
+        try:
+            time.sleep(delay)
+        finally:
+            self._track(queued=-count, retrying=-count)
+
+    async def wait_to_retry_async(self, attempt, error, count=1):
+        delay = self._retry_delay(attempt, error, count)
+        self._track(queued=count, retrying=count)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._track(queued=-count, retrying=-count)
+
+    def _retry_delay(self, attempt, error, count):
+        delay = self.backoff(attempt, error)
+        SEND_RETRIES.labels(str(error_status(error) or "network")).inc(count)
+        print(
+            f"Send of {count} message(s) failed ({error_status(error) or error!r}), "
+            f"retry {attempt} in {delay:.1f}s"
+        )
+        return delay
+
+    def _track(self, queued=0, in_flight=0, retrying=0):
+        with self._lock:
+            self._queued += queued
+            self._in_flight += in_flight
+            self._retrying += retrying
+            SEND_QUEUE_DEPTH.set(self._queued + self._in_flight)
+            SEND_DRAIN_SECONDS.set(self._drain_seconds())
+
+    def _drain_seconds(self):
+        backlog = self._queued + self._in_flight
+        return max(0, backlog - self.bucket.available()) / self.bucket.rate
+
+    def stats(self):
+        """
+        Returns:
+            dict: Messages waiting to send (including those backing off
+                before a retry), messages being sent, and the expected
+                seconds until all of them have gone out at the current rate.
+        """
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "retrying": self._retrying,
+                "in_flight": self._in_flight,
+                "rate_per_second": self.bucket.rate,
+                "expected_drain_seconds": round(self._drain_seconds(), 2),
+            }
+
+
+_send_scheduler = None
+_send_scheduler_lock = threading.Lock()
+
+
+def get_send_scheduler():
+    """
+    Returns:
+        SendScheduler: This process's Gmail send scheduler.
+    """
+    global _send_scheduler
+    with _send_scheduler_lock:
+        if _send_scheduler is None:
+            _send_scheduler = SendScheduler()
+        return _send_scheduler
+
+
+def check_rate_limit(messages=150, batch_size=50, rate=50, burst=10):
+    """
+    Send `messages` no-op messages in batches through a scheduler and check
+    that they took at least (messages - burst) / rate seconds, however they
+    are batched.
+
+    Returns:
+        bool: True if the rate limit held.
+    """
+    scheduler = SendScheduler(rate=rate, burst=burst, max_attempts=1)
+    started = time.monotonic()
+    for start in range(0, messages, batch_size):
+        scheduler.send(lambda: None, count=min(batch_size, messages - start))
+    elapsed = time.monotonic() - started
+    expected = (messages - burst) / rate
+    print(
+        f"{messages} messages in batches of {batch_size}: {elapsed:.2f}s "
+        f"(at least {expected:.2f}s at {rate}/s with a burst of {burst})"
+    )
+    return elapsed >= expected
+
+
+if __name__ == "__main__":
+    passed = all(
+        check_rate_limit(batch_size=batch_size) for batch_size in (1, 10, 50, 150)
+    )
+    raise SystemExit(0 if passed else 1)
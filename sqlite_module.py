@@ -0,0 +1,18 @@
+import sqlite3
+
+
+def sqlite_connection(local, db_path):
+    """
+    Returns:
+        sqlite3.Connection: This thread's connection to the SQLite file at
+            `db_path`, opened in autocommit and WAL mode on first use and
+            kept on `local` (a threading.local). sqlite3 connections cannot
+            be shared across threads.
+    """
+    connection = getattr(local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        local.connection = connection
+    return connection
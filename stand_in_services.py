@@ -0,0 +1,293 @@
+"""
+Local stand-ins for the Typeform responses API and Gmail's messages.send,
+for load testing the server without touching the real services.
+
+    python stand_in_services.py --responses 2000 --latency 0.05 --error-rate 0.02
+
+Then start the server against them:
+
+    TYPEFORM_API_BASE_URL=http://127.0.0.1:8091 \\
+    GMAIL_API_ENDPOINT=http://127.0.0.1:8092/ \\
+    gunicorn app:app -c gunicorn_config.py
+
+The Typeform stand-in serves synthetic responses (see benchmark.py) newest
+first, paginated with `page_size` and `before` like the real API. The Gmail
+stand-in accepts single, batch and media upload (simple or resumable) sends
+without delivering anything.
+Both add the configured latency to every request and fail the configured
+share of them, and report their counts at GET /stats.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmark import synthetic_raw_responses
+
+STATUS_REASONS = {429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class StandInConfig:
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=429, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def delay(self):
+        # Uniform between half and one and a half times the mean latency.
+        if self.latency:
+            with self.lock:
+                factor = self.random.uniform(0.5, 1.5)
+            time.sleep(self.latency * factor)
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    config = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def send_body(self, status, body, content_type="application/json", headers=()):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_status(self):
+        status = self.config.error_status
+        self.config.count(f"errors_{status}")
+        self.send_body(
+            status,
+            {"error": {"code": status, "message": STATUS_REASONS.get(status, "")}},
+            headers=[("Retry-After", "1")] if status == 429 else (),
+        )
+
+    def send_stats(self):
+        with self.config.lock:
+            self.send_body(200, dict(self.config.counts))
+
+
+class TypeformHandler(StandInHandler):
+    responses = []
+    token_index = {}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            return self.send_stats()
+        if not url.path.endswith("/responses"):
+            return self.send_body(404, {"error": "not found"})
+
+        self.config.delay()
+        if self.config.should_fail():
+            return self.send_error_status()
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page_size = min(int(params.get("page_size", 25)), 1000)
+        start = 0
+        if params.get("before"):
+            start = self.token_index.get(params["before"], len(self.responses)) + 1
+
+        items = []
+        for raw_response in self.responses[start:]:
+            if len(items) >= page_size:
+                break
+            submitted_at = raw_response["submitted_at"]
+            if params.get("since") and submitted_at < params["since"]:
+                continue
+            if params.get("until") and submitted_at > params["until"]:
+                continue
+            items.append(raw_response)
+
+        self.config.count("pages")
+        self.config.count("responses", len(items))
+        self.send_body(
+            200,
+            {"total_items": len(self.responses), "page_count": 1, "items": items},
+        )
+
+    def do_PUT(self):
+        self.read_body()
+        self.send_body(200, {"id": "stand-in-webhook", "enabled": True})
+
+
+class GmailHandler(StandInHandler):
+    # Resumable upload sessions: upload id -> bytes received so far.
+    uploads = {}
+    uploads_lock = threading.Lock()
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/stats":
+            return self.send_stats()
+        self.send_body(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        if url.path.endswith("/batch"):
+            return self.send_batch(body)
+        if url.path.endswith("/messages/send"):
+            self.config.delay()
+            if self.config.should_fail():
+                return self.send_error_status()
+            if parse_qs(url.query).get("uploadType") == ["resumable"]:
+                return self.start_upload(url)
+            return self.send_body(200, self.sent_message(len(body)))
+        self.send_body(404, {"error": "not found"})
+
+    def start_upload(self, url):
+        upload_id = uuid.uuid4().hex
+        with self.uploads_lock:
+            self.uploads[upload_id] = 0
+        self.config.count("resumable_uploads")
+        location = f"http://{self.headers['Host']}{url.path}?upload_id={upload_id}"
+        self.send_body(200, b"", headers=[("Location", location)])
+
+    def do_PUT(self):
+        # One chunk of a resumable upload, with a "bytes first-last/total"
+        # Content-Range.
+        upload_id = parse_qs(urlparse(self.path).query).get("upload_id", [""])[0]
+        body = self.read_body()
+        with self.uploads_lock:
+            if upload_id not in self.uploads:
+                return self.send_body(404, {"error": "unknown upload"})
+            self.uploads[upload_id] += len(body)
+            received = self.uploads[upload_id]
+        self.config.count("upload_chunks")
+
+        total = self.headers.get("Content-Range", "").rpartition("/")[2]
+        if total != "*" and received >= int(total):
+            with self.uploads_lock:
+                del self.uploads[upload_id]
+            return self.send_body(200, self.sent_message(received))
+        self.send_body(308, b"", headers=[("Range", f"bytes=0-{received - 1}")])
+
+    def sent_message(self, size):
+        self.config.count("sent")
+        self.config.count("bytes", size)
+        message_id = uuid.uuid4().hex[:16]
+        return {"id": message_id, "threadId": message_id, "labelIds": ["SENT"]}
+
+    def send_batch(self, body):
+        # One delay for the whole batch, as with the real batch endpoint.
+        self.config.delay()
+        self.config.count("batches")
+        request = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in request.get_payload():
+            if self.config.should_fail():
+                status = self.config.error_status
+                self.config.count(f"errors_{status}")
+                content = {"error": {"code": status}}
+            else:
+                status = 200
+                content = self.sent_message(len(part.get_payload()))
+            content = json.dumps(content)
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {STATUS_REASONS.get(status, 'OK')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\n\r\n"
+                f"{content}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        self.send_body(
+            200,
+            "".join(parts).encode(),
+            content_type=f"multipart/mixed; boundary={boundary}",
+        )
+
+
+def typeform_responses(count, seed=None):
+    """
+    Returns:
+        list: Synthetic raw responses, newest first, one minute apart.
+    """
+    raw_responses = synthetic_raw_responses(count, seed)
+    newest = datetime.now(timezone.utc).replace(microsecond=0)
+    for index, raw_response in enumerate(raw_responses):
+        raw_response["token"] = f"stand-in-{index}"
+        submitted_at = newest - timedelta(minutes=index)
+        raw_response["submitted_at"] = submitted_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return raw_responses
+
+
+def serve(handler, port, config):
+    handler = type(handler.__name__, (handler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--typeform-port", type=int, default=8091)
+    parser.add_argument("--gmail-port", type=int, default=8092)
+    parser.add_argument("--responses", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    TypeformHandler.responses = typeform_responses(args.responses, args.seed)
+    TypeformHandler.token_index = {
+        raw_response["token"]: index
+        for index, raw_response in enumerate(TypeformHandler.responses)
+    }
+
+    servers = []
+    for handler, port in [
+        (TypeformHandler, args.typeform_port),
+        (GmailHandler, args.gmail_port),
+    ]:
+        config = StandInConfig(
+            args.latency, args.error_rate, args.error_status, args.seed
+        )
+        servers.append(serve(handler, port, config))
+        print(f"{handler.__name__[:-7]} stand-in on http://127.0.0.1:{port}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    StrictUndefined,
+)
+
+REPORT_TEMPLATE_DIR = os.getenv("REPORT_TEMPLATE_DIR", "templates")
+# Compiled templates are kept here, so a new process loads them instead of
+# compiling them again.
+REPORT_TEMPLATE_CACHE_DIR = os.getenv(
+    "REPORT_TEMPLATE_CACHE_DIR", "data/template_cache"
+)
+# Pick up edited templates without restarting the server. Each template is
+# checked for changes when it is next used.
+REPORT_TEMPLATE_AUTO_RELOAD = (
+    os.getenv("REPORT_TEMPLATE_AUTO_RELOAD", "true").lower() == "true"
+)
+
+_environment = None
+_environment_lock = threading.Lock()
+_static_renders = {}
+_static_renders_lock = threading.Lock()
+_templates_digest = (None, None)
+
+
+def get_template_environment():
+    """
+    Returns:
+        jinja2.Environment: The environment the report sections are rendered
+            from, created on first use.
+    """
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            bytecode_cache = None
+            if REPORT_TEMPLATE_CACHE_DIR:
+                os.makedirs(REPORT_TEMPLATE_CACHE_DIR, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(REPORT_TEMPLATE_CACHE_DIR)
+            _environment = Environment(
+                loader=FileSystemLoader(REPORT_TEMPLATE_DIR),
+                bytecode_cache=bytecode_cache,
+                auto_reload=REPORT_TEMPLATE_AUTO_RELOAD,
+                # Markdown sections end in blank lines that separate them.
+                keep_trailing_newline=True,
+                undefined=StrictUndefined,
+            )
+        return _environment
+
+
+def render_template(name, **context):
+    """
+    Render a report template.
+
+    Args:
+        name (str): The template's path under REPORT_TEMPLATE_DIR.
+        **context: The template's variables.
+
+    Returns:
+        str: The rendered template.
+    """
+    return get_template_environment().get_template(name).render(context)
+
+
+def render_static_template(name, **context):
+    """
+    Render a template that is the same in every report once, and reuse the
+    result until the template changes.
+
+    Args:
+        name (str): The template's path under REPORT_TEMPLATE_DIR.
+        **context: The template's variables. They must be hashable.
+
+    Returns:
+        str: The rendered template.
+    """
+    template = get_template_environment().get_template(name)
+    key = (name, tuple(sorted(context.items())))
+    with _static_renders_lock:
+        rendered = _static_renders.get(key)
+        # A reloaded template is a new object, so its old render is dropped.
+        if rendered is None or rendered[0] is not template:
+            rendered = (template, template.render(context))
+            _static_renders[key] = rendered
+        return rendered[1]
+
+
+def templates_digest():
+    """
+    Returns:
+        str: A hash of every report template's source, for cache keys of
+            anything rendered from them.
+    """
+    global _templates_digest
+    templates, digest = _templates_digest
+    if templates is not None and (
+        not REPORT_TEMPLATE_AUTO_RELOAD
+        or all(template.is_up_to_date for template in templates)
+    ):
+        return digest
+
+    environment = get_template_environment()
+    templates = []
+    digest = hashlib.sha256()
+    for name in environment.list_templates():
+        templates.append(environment.get_template(name))
+        source, _, _ = environment.loader.get_source(environment, name)
+        digest.update(f"{name}\0{source}\0".encode())
+    _templates_digest = (templates, digest.hexdigest())
+    return _templates_digest[1]
+
+
+def preload_templates():
+    """
+    Compile every report template ahead of the first report. The first
+    process to compile them writes them to REPORT_TEMPLATE_CACHE_DIR, and
+    later ones load them from there.
+    """
+    environment = get_template_environment()
+    for name in environment.list_templates():
+        environment.get_template(name)
@@ -0,0 +1,285 @@
+import math
+
+import fitz
+
+# Colours and sizes of plotly's default template, which the plotly charts use.
+PLOT_BACKGROUND_COLOR = "#E5ECF6"
+GRID_COLOR = "#FFFFFF"
+TRACE_COLOR = "#636EFA"
+TEXT_COLOR = "#2A3F5F"
+FONT_NAME = "helv"
+FONT_SIZE = 12
+
+_placeholders = {}
+_placeholder_samples = {}
+
+
+def hex_to_rgb(color):
+    """
+    Returns:
+        tuple: A "#rrggbb" colour as PyMuPDF (r, g, b) floats.
+    """
+    color = color.lstrip("#")
+    return tuple(int(color[index : index + 2], 16) / 255 for index in (0, 2, 4))
+
+
+def placeholder_image(size):
+    """
+    A blank white PNG of the given pixel size. It holds a chart's place while
+    markdown-pdf lays out the page, so the page keeps the same layout as with
+    a rendered chart image. (The PDF writer drops transparency, so the image
+    is as white as plotly's own chart background rather than transparent.)
+
+    Args:
+        size (tuple): The (width, height) of the chart image it stands in for.
+
+    Returns:
+        bytes: The PNG.
+    """
+    if size not in _placeholders:
+        pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, *size), False)
+        pixmap.clear_with(255)
+        _placeholders[size] = pixmap.tobytes("png")
+    return _placeholders[size]
+
+
+def is_placeholder_image(document, xref, size):
+    """
+    Returns:
+        bool: True if the image at `xref` is `placeholder_image(size)`, i.e.
+            all of its pixels are white, as markdown-pdf stores them (RGB).
+    """
+    if size not in _placeholder_samples:
+        _placeholder_samples[size] = b"\xff" * (size[0] * size[1] * 3)
+    return document.xref_stream(xref) == _placeholder_samples[size]
+
+
+def remove_placeholder_image(document, xref):
+    """
+    Empty a placeholder image once its chart is drawn: it becomes a 1x1
+    image mask that paints nothing, wherever it is used. Like
+    `Page.delete_image`, but without inserting and copying a new image.
+
+    Args:
+        document (fitz.Document): The document the image is in.
+        xref (int): The image's xref.
+    """
+    document.update_object(
+        xref,
+        "<</Type/XObject/Subtype/Image/Width 1/Height 1"
+        "/ImageMask true/BitsPerComponent 1>>",
+    )
+    # With an image mask, a 1 bit leaves the page unpainted.
+    document.update_stream(xref, b"\xff")
+
+
+def nice_step(span, target_ticks=5):
+    """
+    Returns:
+        float: A 1, 2, 2.5 or 5 times a power of ten tick step that splits
+            `span` into about `target_ticks` intervals.
+    """
+    rough = span / target_ticks
+    magnitude = 10 ** math.floor(math.log10(rough))
+    for multiple in [1, 2, 2.5, 5, 10]:
+        if multiple * magnitude >= rough:
+            return multiple * magnitude
+
+
+def draw_radar_chart(page, rect, values, labels, canvas_size=(700, 500)):
+    """
+    Draw a filled radar chart laid out like plotly's `line_polar` with its
+    default margins, scaled to fit `rect`.
+
+    Args:
+        page (fitz.Page): The page to draw on.
+        rect (fitz.Rect): Where the chart's image would have been placed.
+        values (list): The value on each axis.
+        labels (list): The name of each axis, clockwise from the top.
+        canvas_size (tuple): The pixel size of the plotly chart it replaces.
+    """
+    scale = rect.width / canvas_size[0]
+    # Plotly's default margins are 80px on the sides and bottom and 100px on
+    # top; the polar area is the largest circle that fits inside them.
+    plot_width = canvas_size[0] - 160
+    plot_height = canvas_size[1] - 180
+    center = fitz.Point(
+        rect.x0 + (80 + plot_width / 2) * scale,
+        rect.y0 + (100 + plot_height / 2) * scale,
+    )
+    radius = min(plot_width, plot_height) / 2 * scale
+    font_size = FONT_SIZE * scale
+
+    step = nice_step(max(values) or 1)
+    maximum = max(values) * 1.05 or step
+    angles = [
+        math.radians(90 - 360 * index / len(values)) for index in range(len(values))
+    ]
+
+    def point(angle, distance):
+        return fitz.Point(
+            center.x + distance * math.cos(angle), center.y - distance * math.sin(angle)
+        )
+
+    shape = page.new_shape()
+    shape.draw_circle(center, radius)
+    shape.finish(fill=hex_to_rgb(PLOT_BACKGROUND_COLOR), width=0)
+
+    ticks = [step * index for index in range(1, int(maximum / step) + 1)]
+    for tick in ticks:
+        shape.draw_circle(center, radius * tick / maximum)
+    for angle in angles:
+        shape.draw_line(center, point(angle, radius))
+    shape.finish(color=hex_to_rgb(GRID_COLOR), width=scale)
+
+    polygon = [
+        point(angle, radius * value / maximum) for angle, value in zip(angles, values)
+    ]
+    shape.draw_polyline(polygon + polygon[:1])
+    shape.finish(
+        color=hex_to_rgb(TRACE_COLOR),
+        fill=hex_to_rgb(TRACE_COLOR),
+        fill_opacity=0.5,
+        width=2 * scale,
+        closePath=True,
+    )
+
+    for tick in [0] + ticks:
+        shape.insert_text(
+            point(math.pi / 2, radius * tick / maximum) + (3 * scale, font_size / 3),
+            f"{tick:g}",
+            fontname=FONT_NAME,
+            fontsize=font_size,
+            color=hex_to_rgb(TEXT_COLOR),
+        )
+
+    for angle, label in zip(angles, labels):
+        width = fitz.get_text_length(label, FONT_NAME, font_size)
+        anchor = point(angle, radius + 8 * scale)
+        # Centre labels above and below the circle; push side labels outwards.
+        x = anchor.x - width / 2 * (1 - math.cos(angle))
+        y = anchor.y + font_size / 3 - math.sin(angle) * font_size / 2
+        shape.insert_text(
+            (x, y),
+            label,
+            fontname=FONT_NAME,
+            fontsize=font_size,
+            color=hex_to_rgb(TEXT_COLOR),
+        )
+
+    shape.commit()
+
+
+def wrap_text(text, width, font_size):
+    """
+    Returns:
+        list: The lines `text` breaks into at the given width.
+    """
+    lines = []
+    for paragraph in str(text).split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}".strip()
+            if line and fitz.get_text_length(candidate, FONT_NAME, font_size) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def draw_table(
+    page,
+    rect,
+    header,
+    columns,
+    column_widths,
+    header_color,
+    row_colors,
+    align,
+    header_font_size=20,
+    cell_font_size=18,
+    line_width=12,
+    canvas_width=700,
+):
+    """
+    Draw a table styled like a plotly `go.Table`: filled cells separated by
+    white borders, with text wrapped to each column. Font sizes are reduced
+    if the table would not fit inside `rect`.
+
+    Args:
+        page (fitz.Page): The page to draw on.
+        rect (fitz.Rect): Where the table's image would have been placed.
+        header (list): The header text of each column.
+        columns (list): Each column's cell values, top to bottom.
+        column_widths (list): Relative widths of the columns.
+        header_color (str): The header fill colour, as "#rrggbb".
+        row_colors (list): Each row's fill colour, as "#rrggbb".
+        align (list): Each column's text alignment ("left" or "center").
+        header_font_size (float): The header font size in chart pixels.
+        cell_font_size (float): The cell font size in chart pixels.
+        line_width (float): The border width in chart pixels.
+        canvas_width (int): The pixel width of the plotly chart it replaces.
+    """
+    scale = rect.width / canvas_width
+    padding = 8 * scale
+    widths = [rect.width * width / sum(column_widths) for width in column_widths]
+    rows = [list(row) for row in zip(*columns)]
+
+    def layout(font_scale):
+        sizes = [header_font_size * scale * font_scale] + [
+            cell_font_size * scale * font_scale
+        ] * len(rows)
+        wrapped = [
+            [
+                wrap_text(text, width - 2 * padding, size)
+                for text, width in zip(row, widths)
+            ]
+            for row, size in zip([header] + rows, sizes)
+        ]
+        heights = [
+            max(28 * scale, max(map(len, cells)) * size * 1.2 + 2 * padding)
+            for cells, size in zip(wrapped, sizes)
+        ]
+        return sizes, wrapped, heights
+
+    font_scale = 1
+    sizes, wrapped, heights = layout(font_scale)
+    while sum(heights) > rect.height and font_scale > 0.3:
+        font_scale *= 0.9
+        sizes, wrapped, heights = layout(font_scale)
+
+    shape = page.new_shape()
+    fills = [header_color] + list(row_colors)
+    top = rect.y0
+    for row_index, (cells, size, height) in enumerate(zip(wrapped, sizes, heights)):
+        left = rect.x0
+        for column_index, (lines, width) in enumerate(zip(cells, widths)):
+            cell = fitz.Rect(left, top, left + width, top + height)
+            shape.draw_rect(cell)
+            shape.finish(
+                fill=hex_to_rgb(fills[row_index]),
+                color=hex_to_rgb(GRID_COLOR),
+                width=line_width * scale,
+            )
+
+            alignment = "center" if row_index == 0 else align[column_index]
+            baseline = top + padding + size
+            for line in lines:
+                x = cell.x0 + padding
+                if alignment == "center":
+                    line_width_points = fitz.get_text_length(line, FONT_NAME, size)
+                    x = cell.x0 + (width - line_width_points) / 2
+                shape.insert_text(
+                    (x, baseline),
+                    line,
+                    fontname=FONT_NAME,
+                    fontsize=size,
+                    color=hex_to_rgb(TEXT_COLOR),
+                )
+                baseline += size * 1.2
+            left += width
+        top += height
+
+    shape.commit()